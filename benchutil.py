@@ -0,0 +1,903 @@
+#!/usr/bin/env python3.5
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018 Chunheng Jiang (jiangchunheng@gmail.com)
+# Created at 10:12 AM Oct 17, 2018
+
+import gzip
+import os
+import pickle
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import datautil
+
+from citcredit import IntrinsicCredit, PRImportanceBased, Shen
+from datautil import DATABASE, GRAPH, JOURNALS, Author, CitNet, CitNode, iter_aps, read_table, write_table
+
+
+def peak_rss():
+    """Peak resident set size of the calling process in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on macOS, kilobytes on Linux
+        return rss / 1024.0 / 1024.0
+    return rss / 1024.0
+
+
+def write_synthetic_aps(xml, num_articles, num_authors=5, journal='Synthetic'):
+    """
+    Writes a synthetic APS metadata dump with num_articles articles of
+    num_authors authors each, with DOIs 10.1103/<journal>.<number>.
+    """
+    with open(xml, 'w+') as file:
+        file.write('<articles>\n')
+        for i in range(num_articles):
+            file.write('<article><doi>10.1103/{0}.{1}</doi>'.format(journal, i))
+            file.write('<issue><printdate>2018-03-20</printdate></issue><authgrp>')
+            for j in range(num_authors):
+                file.write('<author><givenname>Given{0}</givenname><middlename>M</middlename>'
+                           '<surname>Surname{1}</surname></author>'.format(j, (i + j) % 1000))
+            file.write('</authgrp></article>\n')
+        file.write('</articles>\n')
+
+
+def _parse_journal(xml):
+    start = time.time()
+    count = 0
+    for _ in iter_aps(xml):
+        count += 1
+    return count, time.time() - start, peak_rss()
+
+
+def bench_parse_aps(xmls):
+    """
+    Reports articles/sec and peak RSS of the streaming parser per journal.
+    Each journal is parsed in a fresh worker process so its peak RSS is not
+    inflated by the journals before it.
+    """
+    print('journal,articles,seconds,articles/sec,peak RSS (MB)')
+    for xml in xmls:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            count, elapsed, rss = pool.submit(_parse_journal, xml).result()
+        name = os.path.splitext(os.path.basename(xml))[0]
+        print('{0},{1},{2:.2f},{3:.0f},{4:.1f}'.format(name, count, elapsed, count / elapsed, rss))
+
+
+def top_cited(graph, fraction=0.01):
+    """The fraction of most cited articles, most cited first."""
+    indegrees = graph.num_citations(np.arange(len(graph)))
+    num = max(1, int(len(graph) * fraction))
+    return np.argsort(-indegrees, kind='mergesort')[:num]
+
+
+def _legacy_cocitation(graph, ind):
+    """Co-citation counts the way Shen.allocate used to compute them."""
+    cooccurence = []
+    for c in graph.citations(ind):
+        cooccurence += graph.references(c).tolist()
+    return {x: cooccurence.count(x) for x in cooccurence}
+
+
+def bench_cocitation(path=GRAPH, fraction=0.01):
+    """
+    Times the list.count co-citation counting against Shen.cocitation on
+    the top fraction of most cited articles and checks that they agree.
+    """
+    algo = Shen(path)
+    legacy, vectorized = 0.0, 0.0
+    top = top_cited(algo.graph, fraction)
+    for ind in top:
+        start = time.time()
+        expected = _legacy_cocitation(algo.graph, ind)
+        legacy += time.time() - start
+
+        start = time.time()
+        cocited, counts = algo.cocitation(ind)
+        vectorized += time.time() - start
+
+        assert dict(zip(cocited.tolist(), counts.tolist())) == expected
+    print('papers,legacy (s),vectorized (s),speedup')
+    print('{0},{1:.2f},{2:.2f},{3:.1f}'.format(len(top), legacy, vectorized, legacy / vectorized))
+
+
+def bench_allocate_cache(path=GRAPH, fraction=0.0001, passes=5, cache_bytes=256 << 20):
+    """
+    Times passes rounds of Shen.allocate over the top fraction of most
+    cited articles without and with a cache of cache_bytes, and checks
+    that both give the same credits.
+    """
+    print('papers,passes,uncached (s),cached (s),hit rate')
+    results, times = [], []
+    for budget in [None, cache_bytes]:
+        algo = Shen(path, cache_bytes=budget)
+        top = top_cited(algo.graph, fraction)
+        start = time.time()
+        for _ in range(passes):
+            credits = [algo.allocate(ind)[1] for ind in top]
+        times.append(time.time() - start)
+        results.append(credits)
+    for uncached, cached in zip(*results):
+        assert np.allclose(uncached, cached)
+    print('{0},{1},{2:.2f},{3:.2f},{4:.2f}'.format(len(top), passes, times[0], times[1],
+                                                   algo.cache_stats()['hit_rate']))
+
+
+def bench_pagerank_lookup(path=GRAPH, scores='pagerank', fraction=0.01):
+    """
+    Times gathering the PageRank scores of the citing papers of the top
+    fraction of most cited articles, by a DataFrame scan per citing paper
+    as PRImportanceBased.allocate used to, and by indexing the score array.
+    """
+    algo = PRImportanceBased(path, scores)
+    table = read_table(scores)
+    scan, indexed = 0.0, 0.0
+    top = top_cited(algo.graph, fraction)
+    for ind in top:
+        citations = algo.graph.citations(ind)
+
+        start = time.time()
+        expected = [table.pr[table.i == c].values[0] for c in citations]
+        scan += time.time() - start
+
+        start = time.time()
+        found = algo.importance(citations)
+        indexed += time.time() - start
+
+        assert np.array_equal(found, expected)
+    print('papers,citations,scan (s),indexed (s),speedup')
+    num_cits = int(algo.graph.num_citations(top).sum())
+    print('{0},{1},{2:.2f},{3:.4f},{4:.0f}'.format(len(top), num_cits, scan, indexed, scan / indexed))
+
+
+class _LegacyAuthor(object):
+    """Author as it was, recomputing its features on every hash and ==."""
+
+    def __init__(self, given, middle, surname):
+        self.given = given
+        self.middle = middle
+        self.surname = surname
+        self.id = -1
+
+    def __hash__(self):
+        nms = self.features()
+        return hash((nms[0], nms[1], nms[2]))
+
+    def features(self):
+        return [self.given[0].title() if self.given else '', self.middle[0].title() if self.middle else '',
+                self.surname.title() if self.surname else '']
+
+    def __eq__(self, other):
+        return self.features() == other.features()
+
+
+def _legacy_clean(name):
+    """The per character cleaning CitNet.sort_out_names used to do."""
+    name = ''.join([_ for _ in name if not _.isdigit()])
+    name = name.replace('†', '').replace('@f', '')
+    name = name.replace(',', ' ').strip()
+    return ' '.join(name.split())
+
+
+def _letters(num):
+    """num spelled in base 26 with the letters a to z."""
+    word = ''
+    while True:
+        num, digit = divmod(num, 26)
+        word = chr(ord('a') + digit) + word
+        if not num:
+            return word
+
+
+def synthetic_mentions(num_mentions, num_authors=100000, seed=0):
+    """
+    Raw [given, middle, surname] author mentions drawn from num_authors
+    distinct authors, with the digits, daggers and commas of the APS dumps.
+    """
+    rng = np.random.RandomState(seed)
+    noise = ['', '', '', '1', '†', ',', '2,']
+    mentions = []
+    for a in rng.randint(0, num_authors, size=num_mentions):
+        mentions.append([_letters(a % 26) + 'given' + noise[a % 7], 'M' if a % 3 else '',
+                         _letters(a) + noise[(a // 7) % 7] + 'son'])
+    return mentions
+
+
+def bench_authors(num_mentions=1000000):
+    """
+    Times sorting out and deduplicating a synthetic stream of author
+    mentions: per character cleaning and features hashed on every lookup
+    as before, against the translate table and per mention cached keys, or
+    vectorized keys joined in bulk against the authors seen so far. Checks
+    that all assign the same ids.
+    """
+    mentions = synthetic_mentions(num_mentions)
+    net = CitNet()
+
+    start = time.time()
+    legacy_names = [[_legacy_clean(name) for name in names] for names in mentions]
+    legacy_clean = time.time() - start
+
+    start = time.time()
+    names = [net.sort_out_names(list(raw)) for raw in mentions]
+    clean = time.time() - start
+    assert names == legacy_names
+
+    start = time.time()
+    authbook, legacy_ids = dict(), []
+    for given, middle, surname in legacy_names:
+        legacy_ids.append(authbook.setdefault(_LegacyAuthor(given, middle, surname), len(authbook)))
+    legacy = time.time() - start
+
+    start = time.time()
+    keyed_ids = [net.register(Author(given, middle, surname)) for given, middle, surname in names]
+    keyed = time.time() - start
+
+    table = pd.DataFrame(names, columns=['given', 'middle', 'surname'])
+    start = time.time()
+    bulk_ids = CitNet().register_table(table)
+    bulk = time.time() - start
+
+    assert keyed_ids == legacy_ids and bulk_ids.tolist() == legacy_ids
+    print('mentions,authors,step,legacy (s),new (s),speedup')
+    fmt = '{0},{1},{2},{3:.2f},{4:.2f},{5:.1f}'
+    print(fmt.format(num_mentions, len(authbook), 'clean', legacy_clean, clean, legacy_clean / clean))
+    print(fmt.format(num_mentions, len(authbook), 'dedup keyed', legacy, keyed, legacy / keyed))
+    print(fmt.format(num_mentions, len(authbook), 'dedup bulk', legacy, bulk, legacy / bulk))
+
+
+def write_synthetic_tables(num_articles, num_citations=10, no_authors=0.01, seed=0):
+    """
+    Writes synthetic articles, authorship and citing_cited tables to the
+    working directory: num_citations references per article on average,
+    three authors per article but for a no_authors fraction of them, and 1%
+    of the references to DOIs outside the corpus.
+    """
+    rng = np.random.RandomState(seed)
+    dois = np.array(['10.1103/Synthetic.{0}'.format(i) for i in range(num_articles)], dtype=object)
+    write_table(pd.DataFrame({'id': np.arange(num_articles), 'doi': dois}), 'articles')
+
+    authored = np.flatnonzero(rng.rand(num_articles) >= no_authors)
+    articles = np.repeat(authored, 3)
+    authors = rng.randint(0, max(1, num_articles // 3), size=len(articles))
+    write_table(pd.DataFrame({'article': articles, 'author': authors}), 'authorship')
+
+    num_edges = num_articles * num_citations
+    cited = dois[rng.randint(0, num_articles, size=num_edges)]
+    cited[rng.rand(num_edges) < 0.01] = '10.1103/Outside'
+    write_table(pd.DataFrame({'citing_doi': dois[rng.randint(0, num_articles, size=num_edges)],
+                              'cited_doi': cited}), 'citing_cited')
+
+
+def _legacy_nodes(net):
+    """Article nodes the way CitNet.parse_nodes used to build them."""
+    articles = read_table('articles', columns=['id', 'doi'])
+    indicies_doi = dict(zip(articles.doi, articles.id))
+
+    table = read_table(net.file_cit_net)
+    references = dict(table.groupby('citing_doi', observed=True)['cited_doi'].apply(list))
+    citations = dict(table.groupby('cited_doi', observed=True)['citing_doi'].apply(list))
+
+    authorship = read_table('authorship')
+    authors = dict(authorship.groupby('article')['author'].apply(list))
+
+    nodes = {}
+    for i in range(articles.shape[0]):
+        article = articles.iloc[i]
+        node = CitNode()
+        doi = article.doi
+        node.authors = authors[article.id]
+        if doi in references:
+            node.references = set([indicies_doi[r] for r in references[doi] if r in indicies_doi])
+        if doi in citations:
+            node.citations = set([indicies_doi[c] for c in citations[doi] if c in indicies_doi])
+        nodes[indicies_doi[doi]] = node
+    return nodes
+
+
+def _check_authorless(net, nodes):
+    """
+    Checks that the articles without authorship rows got nodes with no
+    authors and with the references and citations of the citation table.
+    """
+    articles = read_table('articles', columns=['id', 'doi'])
+    missing = np.setdiff1d(articles.id.values, read_table('authorship').article.values)
+    assert len(missing) > 0
+
+    indices_doi = pd.Series(articles.id.values, index=np.asarray(articles.doi, dtype=object))
+    table = read_table(net.file_cit_net)
+    citing = indices_doi.reindex(np.asarray(table.citing_doi, dtype=object)).values
+    cited = indices_doi.reindex(np.asarray(table.cited_doi, dtype=object)).values
+    edges = pd.DataFrame({'citing': citing, 'cited': cited}).dropna().astype(np.int64)
+    references = edges[edges.citing.isin(missing)].groupby('citing')['cited'].apply(set)
+    citations = edges[edges.cited.isin(missing)].groupby('cited')['citing'].apply(set)
+    for i in missing.tolist():
+        assert nodes[i].authors == []
+        assert nodes[i].references == references.get(i, set())
+        assert nodes[i].citations == citations.get(i, set())
+
+
+def bench_nodes(num_articles=1000000, num_legacy=20000):
+    """
+    Times CitNet.parse_nodes on a synthetic corpus of num_articles. The
+    per row build it replaced is timed on num_legacy articles, which all
+    have authors as it fails otherwise, and both must give the same nodes.
+    The articles the full corpus leaves without authors must come out with
+    none, and with their references and citations all the same.
+    """
+    cwd, tmp = os.getcwd(), tempfile.mkdtemp()
+    os.chdir(tmp)
+    try:
+        net = CitNet()
+        net.file_cit_net = 'citing_cited'
+
+        write_synthetic_tables(num_legacy, no_authors=0.0)
+        start = time.time()
+        expected = _legacy_nodes(net)
+        legacy = time.time() - start
+        start = time.time()
+        net.parse_nodes()
+        bulk = time.time() - start
+        with open('citnodes.db', 'rb') as fd:
+            nodes = pickle.load(fd)
+        assert sorted(nodes.keys()) == sorted(expected.keys())
+        for i, node in expected.items():
+            assert nodes[i].authors == node.authors
+            assert nodes[i].references == node.references and nodes[i].citations == node.citations
+
+        print('articles,legacy (s),bulk (s),speedup')
+        print('{0},{1:.2f},{2:.2f},{3:.0f}'.format(num_legacy, legacy, bulk, legacy / bulk))
+
+        write_synthetic_tables(num_articles)
+        start = time.time()
+        net.parse_nodes()
+        elapsed = time.time() - start
+        with open('citnodes.db', 'rb') as fd:
+            nodes = pickle.load(fd)
+        assert len(nodes) == num_articles
+        _check_authorless(net, nodes)
+        print('{0},,{1:.2f},'.format(num_articles, elapsed))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+
+def _ingest(num_articles, citing, cited):
+    """
+    Ingests the synthetic journals under DATABASE, num_articles[journal]
+    articles each, and the citations between the given DOIs the way a
+    monthly update does, then builds the graph in GRAPH.
+    """
+    for journal in JOURNALS:
+        write_synthetic_aps(datautil.DATABASE + journal + '.xml', num_articles[journal], 2, journal)
+    net = CitNet()
+    net.file_cit_net = 'citing_cited'
+    net.parse_aps()
+    os.replace('articles2.feather', 'articles.feather')
+    write_table(pd.DataFrame({'citing_doi': citing, 'cited_doi': cited}), 'citing_cited')
+    net.parse_graph()
+
+
+def bench_reingest(num_articles=2000, num_citations=5, seed=0):
+    """
+    Re-ingests a synthetic corpus of num_articles per journal after adding
+    one article, citing three others, to the first journal, which shifts
+    the ids of every later journal. IntrinsicCredit.build_matrices must
+    still update only the row of the new article, end up with S = R^T R,
+    and carry every stored paper over to the one of the same DOI.
+    """
+    cwd, tmp = os.getcwd(), tempfile.mkdtemp()
+    database = datautil.DATABASE
+    os.chdir(tmp)
+    datautil.DATABASE = tmp + os.sep
+    try:
+        rng = np.random.RandomState(seed)
+        sizes = {journal: num_articles for journal in JOURNALS}
+        dois = np.array(['10.1103/{0}.{1}'.format(journal, i) for journal in JOURNALS
+                         for i in range(num_articles)], dtype=object)
+        num_edges = len(dois) * num_citations
+        citing = dois[rng.randint(0, len(dois), size=num_edges)]
+        cited = dois[rng.randint(0, len(dois), size=num_edges)]
+        _ingest(sizes, citing, cited)
+        algo = IntrinsicCredit()
+        assert algo.build_matrices() is None
+        before = algo.graph.dois()
+
+        new = '10.1103/{0}.{1}'.format(JOURNALS[0], num_articles)
+        sizes[JOURNALS[0]] += 1
+        _ingest(sizes, np.append(citing, [new] * 3), np.append(cited, dois[:3]))
+        algo = IntrinsicCredit()
+        with open(os.path.join(GRAPH, 'matrices.db'), 'rb') as fd:
+            stored = pickle.load(fd)
+        start = time.time()
+        rows = algo.build_matrices()
+        incremental = time.time() - start
+        after = algo.graph.dois()
+
+        new_id = int(after.id.values[after.doi.values == new][0])
+        assert int(before.id.values[before.doi.values == dois[-1]][0]) != \
+            int(after.id.values[after.doi.values == dois[-1]][0])
+        assert rows.tolist() == [new_id]
+        assert abs(algo.S - algo.R.T.dot(algo.R)).max() == 0
+
+        # the papers of before land on the ones of after with their DOI
+        carry = algo.carry_over(stored).tocoo()
+        old_dois = pd.Series(np.asarray(before.doi, dtype=object), index=before.id.values)
+        new_dois = pd.Series(np.asarray(after.doi, dtype=object), index=after.id.values)
+        assert carry.nnz == len(before)
+        assert (old_dois[carry.col].values == new_dois[carry.row].values).all()
+
+        start = time.time()
+        algo.build_matrices(incremental=False)
+        rebuild = time.time() - start
+        print('articles,changed rows,incremental (s),rebuild (s)')
+        print('{0},{1},{2:.2f},{3:.2f}'.format(len(after), len(rows), incremental, rebuild))
+    finally:
+        datautil.DATABASE = database
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+
+class ScholarStandIn(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for Google Scholar on a free port, serving a canned
+    results page of num_articles articles at /scholar and their BibTeX
+    exports at /scholar.bib, each response after latency seconds. The
+    times requests arrive at are kept in requests, by path. Connections
+    are kept alive, each new one taking handshake seconds to set up, as
+    a TCP and TLS handshake with a distant server would, and counted in
+    connections. Responses are gzipped for clients that accept it.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, num_articles=10, latency=0.1, handshake=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _StandInHandler)
+        self.num_articles = num_articles
+        self.latency = latency
+        self.handshake = handshake
+        self.connections = 0
+        self.requests = []
+        self.cookies = []
+        self.lock = threading.Lock()
+        self.site = 'http://127.0.0.1:{0}'.format(self.server_address[1])
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def results_page(self):
+        return synthetic_results_page(self.site, self.num_articles)
+
+
+def synthetic_results_page(site, num_articles, filler=0):
+    """
+    A Scholar results page of num_articles articles, laid out as the
+    120726 parser expects, wrapped in filler kilobytes of script and
+    navigation markup as real pages are. Every third article has a PDF
+    link and every fifth is a linkless citation.
+    """
+    articles = []
+    for i in range(num_articles):
+        if i % 5 == 4:
+            title = ('<h3 class="gs_rt"><span class="gs_ctu"><span class="gs_ct1">[CITATION]</span>'
+                     '<span class="gs_ct2">[C]</span></span> Synthetic citation {0}</h3>').format(i)
+        else:
+            title = '<h3 class="gs_rt"><a href="{0}/article/{1}">Synthetic <b>article</b> {1}</a></h3>'.format(site, i)
+        pdf = ''
+        if i % 3 == 0:
+            pdf = ('<div class="gs_ggs gs_fl"><div class="gs_ttss"><a href="{0}/pdf/{1}.pdf">'
+                   '<span class="gs_ctg2">[PDF]</span> aps.org</a></div></div>').format(site, i)
+        articles.append(
+            '<div class="gs_r gs_or gs_scl">{4}<div class="gs_ri">{3}'
+            '<div class="gs_a">A Author, B Author - Phys. Rev., 19{2:02d} - aps.org</div>'
+            '<div class="gs_rs">Excerpt of article {1}\nover two lines</div>'
+            '<div class="gs_fl"><a href="/scholar?cites={1}&amp;as_sdt=2005&amp;num=20">Cited by {5}</a> '
+            '<a href="/scholar?q=related:{1}:scholar.google.com/">Related articles</a> '
+            '<a href="/scholar?cluster={1}&amp;hl=en&amp;num=20">All 2 versions</a> '
+            '<a href="{0}/scholar.bib?q=info:{1}">Import into BibTeX</a></div>'
+            '</div></div>'.format(site, i, i % 100, title, pdf, 10 * i))
+    script = '<script>var gs_settings = {{"n": {0}}};</script>'
+    filler = ''.join(script.format(k) + '<div class="gs_nav"><a href="/n{0}">nav {0}</a></div>'.format(k)
+                     for k in range(filler * 1024 // 80))
+    return ('<html><head><title>Scholar</title>{0}</head><body><div id="gs_top">'
+            '<div id="gs_ab_md">About {1} results (0.05 sec)</div>'
+            '<div id="gs_res_ccl"><div id="gs_res_ccl_mid">{2}</div></div>{0}</div></body></html>'
+            .format(filler, num_articles, ''.join(articles)))
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.handshake)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((time.time(), self.path))
+            server.cookies.append(self.headers.get('Cookie'))
+        time.sleep(server.latency)
+
+        if 'unavailable' in self.path:
+            self.send_error(503)
+            return
+        if self.path.startswith('/scholar.bib'):
+            key = self.path.rsplit(':', 1)[1]
+            body = '@article{{synthetic{0},\n  title={{Synthetic article {0}}}\n}}\n'.format(key)
+        else:
+            body = server.results_page()
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Set-Cookie', 'GSP=ID=synthetic; Path=/')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _fetch_scholar_page(url):
+    """Articles of the results page at url, with their citation data."""
+    import scholar
+
+    querier = scholar.ScholarQuerier()
+    html = querier._get_http_response(url)
+    querier.parse(html)
+    return querier.articles
+
+
+def bench_scholar(num_articles=10, latency=0.2, concurrency=5, interval=0.05):
+    """
+    Retrieves a results page and the citation exports of its articles from
+    a local stand-in server, one export after the other and concurrently,
+    then concurrently with a per host rate limit, checking that all get
+    the same articles and that the rate limit spaces out the requests.
+    """
+    import scholar
+
+    conf = scholar.ScholarConf
+    defaults = conf.MAX_CONCURRENT_REQUESTS, conf.MIN_REQUEST_INTERVAL
+    print('concurrency,rate limit (s),articles,seconds')
+    try:
+        results = []
+        for workers, spacing in [(1, 0), (concurrency, 0), (concurrency, interval)]:
+            conf.MAX_CONCURRENT_REQUESTS, conf.MIN_REQUEST_INTERVAL = workers, spacing
+            with ScholarStandIn(num_articles, latency) as server:
+                start = time.time()
+                articles = _fetch_scholar_page(server.site + '/scholar?q=synthetic')
+                elapsed = time.time() - start
+                arrivals = sorted(t for t, _ in server.requests)
+
+            assert len(articles) == num_articles
+            assert all(art.citation_data is not None for art in articles)
+            if spacing:
+                # a little slack for the clock of the server thread
+                assert min(np.diff(arrivals)) >= spacing * 0.9
+            results.append([(art['title'], art['num_citations'], art.citation_data) for art in articles])
+            print('{0},{1},{2},{3:.2f}'.format(workers, spacing, len(articles), elapsed))
+        assert all(result == results[0] for result in results)
+    finally:
+        conf.MAX_CONCURRENT_REQUESTS, conf.MIN_REQUEST_INTERVAL = defaults
+
+
+def bench_scholar_cache(num_articles=10, latency=0.2):
+    """
+    Retrieves a results page and its citation exports from a local
+    stand-in server twice through a response cache, checking the second
+    run is served from the cache alone, then with a zero TTL, with the
+    cache refreshed and with a size cap, checking they go to the server.
+    """
+    import scholar
+
+    conf = scholar.ScholarConf
+    defaults = conf.CACHE_DIR, conf.CACHE_TTL, conf.CACHE_MAX_BYTES, conf.CACHE_REFRESH
+    tmp = tempfile.mkdtemp()
+    conf.CACHE_DIR = tmp
+    print('run,requests,seconds')
+    try:
+        with ScholarStandIn(num_articles, latency) as server:
+            url = server.site + '/scholar?q=synthetic&hl=en'
+            results = []
+            for run, ttl, refresh in [('cold', None, False), ('warm', None, False),
+                                      ('expired', 0, False), ('refresh', None, True)]:
+                conf.CACHE_TTL, conf.CACHE_REFRESH = ttl, refresh
+                before = len(server.requests)
+                start = time.time()
+                articles = _fetch_scholar_page(url)
+                elapsed = time.time() - start
+                requests = len(server.requests) - before
+                results.append([(art['title'], art.citation_data) for art in articles])
+                print('{0},{1},{2:.2f}'.format(run, requests, elapsed))
+                assert requests == (0 if run == 'warm' else num_articles + 1)
+            assert all(result == results[0] for result in results)
+
+            # arguments in another order are the same query
+            conf.CACHE_TTL, conf.CACHE_REFRESH = None, False
+            before = len(server.requests)
+            _fetch_scholar_page(server.site + '/scholar?hl=en&q=synthetic')
+            assert len(server.requests) == before
+
+            # a cap evicts the least recently used responses first
+            entries = sorted(os.listdir(tmp), key=lambda name: os.path.getatime(os.path.join(tmp, name)))
+            cache = scholar.ScholarCache(tmp, max_bytes=1024)
+            assert cache.size <= 1024 and 0 < len(os.listdir(tmp)) < len(entries)
+            assert entries[-1] in os.listdir(tmp)
+    finally:
+        conf.CACHE_DIR, conf.CACHE_TTL, conf.CACHE_MAX_BYTES, conf.CACHE_REFRESH = defaults
+        shutil.rmtree(tmp)
+
+
+def bench_scholar_batch(num_queries=20, num_articles=3):
+    """
+    Runs scholar.py in batch mode on num_queries queries against a local
+    stand-in server, interrupted by a failing query, then resumes it and
+    checks every query was sent once and its results written once.
+    """
+    import scholar
+
+    site = scholar.ScholarConf.SCHOLAR_SITE
+    query_url = scholar.SearchScholarQuery.SCHOLAR_QUERY_URL
+    argv = sys.argv
+    tmp = tempfile.mkdtemp()
+    jobs, out = os.path.join(tmp, 'jobs.txt'), os.path.join(tmp, 'out.csv')
+    try:
+        with ScholarStandIn(num_articles, latency=0.0) as server:
+            scholar.ScholarConf.SCHOLAR_SITE = server.site
+            scholar.SearchScholarQuery.SCHOLAR_QUERY_URL = query_url.replace(site, server.site)
+            lines = ['-c 1 --phrase "10.1103/PhysRevLett.{0}"'.format(i) for i in range(num_queries)]
+            with open(jobs, 'w') as file:
+                file.write('# nobel papers\n' + '\n'.join(lines[:num_queries // 2]) + '\n-A unavailable\n')
+
+            sys.argv = ['scholar.py', '--batch', jobs, '--output', out, '--csv-header']
+            start = time.time()
+            assert scholar.main() == 1
+            with open(jobs, 'a') as file:
+                file.write('\n'.join(lines[num_queries // 2:]) + '\n')
+            assert scholar.main() == 1
+            elapsed = time.time() - start
+
+            paths = [path for _, path in server.requests if path.startswith('/scholar?')]
+            assert len(paths) == num_queries + 2 and len(set(paths)) == num_queries + 1
+        with open(out) as file:
+            rows = file.read().splitlines()
+        assert len(rows) == 1 + num_queries * num_articles and rows[0].startswith('title|')
+        print('queries,seconds')
+        print('{0},{1:.2f}'.format(num_queries, elapsed))
+    finally:
+        scholar.ScholarConf.SCHOLAR_SITE = site
+        scholar.SearchScholarQuery.SCHOLAR_QUERY_URL = query_url
+        sys.argv = argv
+        shutil.rmtree(tmp)
+
+
+def bench_scholar_keepalive(num_articles=10, latency=0.05, handshake=0.1, concurrency=5):
+    """
+    Retrieves a results page and the citation exports of its articles from
+    a local stand-in server whose connections take handshake seconds to
+    set up, with a connection per request and with pooled keep-alive
+    connections, one export after the other and concurrently. Checks that
+    all get the same articles, that cookies set by the server come back
+    and persist through save_cookies, and reports the request latencies.
+    """
+    import scholar
+
+    conf = scholar.ScholarConf
+    defaults = conf.KEEP_ALIVE, conf.MAX_CONCURRENT_REQUESTS, conf.COOKIE_JAR_FILE
+    tmp = tempfile.mkdtemp()
+    print('keep-alive,concurrency,requests,connections,mean latency (s),seconds')
+    try:
+        results = []
+        for keep_alive in [False, True]:
+            for workers in [1, concurrency]:
+                conf.KEEP_ALIVE, conf.MAX_CONCURRENT_REQUESTS = keep_alive, workers
+                conf.COOKIE_JAR_FILE = os.path.join(tmp, 'cookies.txt')
+                if os.path.exists(conf.COOKIE_JAR_FILE):
+                    os.remove(conf.COOKIE_JAR_FILE)
+                with ScholarStandIn(num_articles, latency, handshake) as server:
+                    querier = scholar.ScholarQuerier()
+                    start = time.time()
+                    html = querier._get_http_response(server.site + '/scholar?q=synthetic')
+                    querier.parse(html)
+                    elapsed = time.time() - start
+                    querier.save_cookies()
+                    if querier.transport is not None:
+                        timings = [timing[1] for timing in querier.transport.timings]
+                        assert len(timings) == len(server.requests)
+                        querier.transport.close()
+                    else:
+                        timings = [np.nan]
+
+                articles = querier.articles
+                assert len(articles) == num_articles
+                assert all(cookie == 'GSP=ID=synthetic' for cookie in server.cookies[1:])
+                assert 'GSP' in [cookie.name for cookie in scholar.ScholarQuerier().cjar]
+                results.append([(art['title'], art['num_citations'], art.citation_data) for art in articles])
+                print('{0},{1},{2},{3},{4:.3f},{5:.2f}'.format(keep_alive, workers, len(server.requests),
+                                                               server.connections, np.mean(timings), elapsed))
+        assert all(result == results[0] for result in results)
+    finally:
+        conf.KEEP_ALIVE, conf.MAX_CONCURRENT_REQUESTS, conf.COOKIE_JAR_FILE = defaults
+        shutil.rmtree(tmp)
+
+
+def bench_scholar_parse(pages='scholar_pages', num_pages=200):
+    """
+    Pages/sec of the results parsers building the whole tree and only
+    the results, over the saved results pages (*.html) under pages, or
+    over num_pages synthetic ones if there are none, checking that both
+    give the same articles, with the 120201 and 120726 layouts.
+    """
+    import scholar
+
+    if os.path.isdir(pages):
+        corpus = []
+        for name in sorted(os.listdir(pages)):
+            if name.endswith('.html'):
+                with open(os.path.join(pages, name), 'rb') as file:
+                    corpus.append(file.read())
+    else:
+        corpus = [synthetic_results_page(scholar.ScholarConf.SCHOLAR_SITE, 10, 50).encode('utf-8')
+                  for _ in range(num_pages)]
+
+    fast_parse = scholar.ScholarConf.FAST_PARSE
+    print('parser,pages,tree,seconds,pages/sec')
+    try:
+        for base in [scholar.ScholarArticleParser120201, scholar.ScholarArticleParser120726]:
+            found = []
+            for fast in [False, True]:
+                scholar.ScholarConf.FAST_PARSE = fast
+                articles = []
+                parser = base()
+                parser.handle_article = lambda art: articles.append(art.attrs)
+                parser.handle_num_results = lambda num: articles.append(num)
+                start = time.time()
+                for html in corpus:
+                    parser.parse(html)
+                elapsed = time.time() - start
+                found.append(articles)
+                print('{0},{1},{2},{3:.2f},{4:.1f}'.format(base.__name__, len(corpus), 'results' if fast else 'full',
+                                                          elapsed, len(corpus) / elapsed))
+            assert found[0] == found[1]
+    finally:
+        scholar.ScholarConf.FAST_PARSE = fast_parse
+
+
+class _LegacyScholarArticle(object):
+    """ScholarArticle as it was, a dict of [value, label, ordinal] lists."""
+
+    def __init__(self):
+        self.attrs = dict((key, [default, label, idx]) for idx, (key, label, default)
+                          in enumerate(_scholar_schema_items()))
+        self.citation_data = None
+
+    def __setitem__(self, key, item):
+        if key in self.attrs:
+            self.attrs[key][0] = item
+        else:
+            self.attrs[key] = [item, key, len(self.attrs)]
+
+    def as_txt(self):
+        items = sorted(list(self.attrs.values()), key=lambda item: item[2])
+        fmt = '%%%ds %%s' % max([len(str(item[1])) for item in items])
+        return '\n'.join([fmt % (item[1], item[0]) for item in items if item[0] is not None])
+
+    def as_csv(self, header=False, sep='|'):
+        keys = [pair[0] for pair in sorted([(key, val[2]) for key, val in list(self.attrs.items())],
+                                           key=lambda pair: pair[1])]
+        res = []
+        if header:
+            res.append(sep.join(keys))
+        res.append(sep.join([str(self.attrs[key][0]) for key in keys]))
+        return '\n'.join(res)
+
+
+def _scholar_schema_items():
+    import scholar
+    return scholar.ScholarArticle.SCHEMA.items()
+
+
+def _fill_article(art, i):
+    art['title'] = 'Synthetic article {0}'.format(i)
+    art['url'] = 'http://example.org/paper/{0}'.format(i)
+    art['year'] = str(1990 + i % 30)
+    art['num_citations'] = i % 500
+    art['num_versions'] = i % 7
+    art['cluster_id'] = str(1000000 + i)
+    art['url_citations'] = 'http://example.org/scholar?cites={0}'.format(1000000 + i)
+    art['url_citation'] = 'http://example.org/scholar.bib?q=info:{0}'.format(i)
+    return art
+
+
+def bench_scholar_articles(num_articles=200000):
+    """
+    Memory held by num_articles harvested ScholarArticles, and the time
+    to write them as CSV, as dicts of triplets before against slotted
+    values with a shared schema. Both must print the same text.
+    """
+    import scholar
+    import tracemalloc
+
+    print('articles,layout,MB,csv seconds,articles/sec')
+    outputs = []
+    for layout in ['dict', 'slots']:
+        make = _LegacyScholarArticle if layout == 'dict' else scholar.ScholarArticle
+        tracemalloc.start()
+        articles = [_fill_article(make(), i) for i in range(num_articles)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.time()
+        if layout == 'dict':
+            rows = [art.as_csv(header=i == 0) for i, art in enumerate(articles)]
+        else:
+            rows = scholar.ScholarArticle.csv_rows(articles, header=True)
+        elapsed = time.time() - start
+        outputs.append(('\n'.join(rows), articles[-1].as_txt()))
+        print('{0},{1},{2:.1f},{3:.2f},{4:.0f}'.format(num_articles, layout, size / 1024.0 / 1024.0,
+                                                       elapsed, num_articles / elapsed))
+        del articles, rows
+    assert outputs[0] == outputs[1]
+
+
+def bench_parse():
+    if os.path.exists(DATABASE):
+        bench_parse_aps([DATABASE + journal + '.xml' for journal in JOURNALS])
+        return
+
+    # peak RSS should not grow with the size of the dump
+    xmls = []
+    for num_articles in [10000, 100000, 1000000]:
+        xml = 'synthetic{0}.xml'.format(num_articles)
+        write_synthetic_aps(xml, num_articles)
+        xmls.append(xml)
+    bench_parse_aps(xmls)
+    for xml in xmls:
+        os.remove(xml)
+
+
+BENCHMARKS = {
+    'allocate_cache': bench_allocate_cache,
+    'authors': bench_authors,
+    'nodes': bench_nodes,
+    'parse': bench_parse,
+    'cocitation': bench_cocitation,
+    'pagerank': bench_pagerank_lookup,
+    'reingest': bench_reingest,
+    'scholar': bench_scholar,
+    'scholar_articles': bench_scholar_articles,
+    'scholar_batch': bench_scholar_batch,
+    'scholar_cache': bench_scholar_cache,
+    'scholar_keepalive': bench_scholar_keepalive,
+    'scholar_parse': bench_scholar_parse,
+}
+
+if __name__ == '__main__':
+    # e.g. python benchutil.py parse cocitation
+    for name in sys.argv[1:] or sorted(BENCHMARKS.keys()):
+        print('== ' + name)
+        BENCHMARKS[name]()
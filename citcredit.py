@@ -5,55 +5,213 @@
 
 import os
 import pickle
+import sys
+import warnings
 
 import numpy as np
 import pandas as pd
 
 from numpy.linalg import pinv
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, lsqr, splu
 
-from datautil import CitNet, CitNode
+from datautil import GRAPH, CitGraph, CocitationIndex, LRUCache, gather, read_table
+from pagerank import pagerank
 
 import networkx as nx
 
 
+def open_index(graph):
+    """
+    The co-citation index of graph, or None if it has none or the one
+    there was built from another graph.
+    """
+    if not CocitationIndex.exists(graph.path):
+        return None
+    index = CocitationIndex(graph.path)
+    if not index.matches(graph):
+        print('The co-citation index of {0} does not match the graph, traversing it instead'.format(graph.path))
+        return None
+    return index
+
+
 class Shen(object):
     """
     Shen's method to compute the collective credit for coauthors
     """
 
-    def __init__(self):
-        with open('citnodes.db', 'rb') as fd:
-            self.nodes = pickle.load(fd)
+    # name of the co-citation index variant weighted by importance
+    WEIGHTS = None
+
+    def __init__(self, path=GRAPH, cache_bytes=None):
+        """
+        With cache_bytes, the authors and credits allocate returns are kept
+        in an LRU cache of that many bytes, keyed by paper, for repeated
+        queries on the same papers.
+        """
+        self.graph = CitGraph(path)
+        self.credit_mat = self.graph.credit_matrix()
+        self.index = open_index(self.graph)
+        self.cache = LRUCache(cache_bytes) if cache_bytes else None
+        # whether the index has the variant of this allocator, checked once
+        self.weighted = None
+
+    def build_index(self, chunk_size=4096):
+        """
+        Builds the co-citation index of the graph, if missing, and the
+        variant weighted by the importance of this allocator.
+        """
+        if self.index is None:
+            CocitationIndex.build(self.graph, chunk_size)
+            self.index = CocitationIndex(self.graph.path)
+        if self.WEIGHTS is not None:
+            weights = self.importance(np.arange(len(self.graph)))
+            self.index.add_weights(self.graph, self.WEIGHTS, weights, chunk_size)
+        self.weighted = None
 
     def allocate(self, ind):
-        node = self.nodes[ind]
-        authors = node.authors
+        if self.cache is not None:
+            return self.cache.get(int(ind), self._load_allocation)
+        return self._allocate(ind)
+
+    def _load_allocation(self, ind):
+        # copies, so the entry holds the authors rather than a view of the
+        # memory-mapped graph, which sizeof could not charge
+        authors, creds = self._allocate(ind)
+        return np.array(authors), np.asarray(creds, dtype=float)
+
+    def _allocate(self, ind):
+        authors = self.graph.authors(ind)
         if len(authors) == 1:
             return authors, [1.0]
 
-        citations = node.citations
+        cocited, strengths = self.cocitation(ind)
 
-        cooccurence = []
-        for c in citations:
-            refs = self.nodes[c].references
-            cooccurence += list(refs)
-
-        count_cooccurence = {x: cooccurence.count(x) for x in cooccurence}
-        cocited = set(cooccurence)
-        strengths = np.array([count_cooccurence[k] for k in cocited])
-
-        creds_mat = np.array(self.get_credit_allocation_mat(authors, cocited))
-        creds = np.matmul(strengths, creds_mat)
+        creds_mat = self.get_credit_allocation_mat(authors, cocited)
+        creds = creds_mat.T.dot(strengths)
         return authors, creds / sum(creds)
 
+    def cocitation(self, ind):
+        """
+        Papers co-cited with ind, sorted, and their co-citation strengths:
+        the number of papers citing ind that also cite them, or, if the
+        citing papers have an importance, the share of the total importance
+        of the papers citing ind that also cite them.
+        """
+        citations = self.graph.citations(ind)
+        weights = self.importance(citations)
+        if self.indexed():
+            cocited, strengths = self.index.cocited(ind, self.WEIGHTS)
+            return cocited, strengths if weights is None else strengths / weights.sum()
+
+        refs = self.graph.gather_references(citations)
+        if weights is None:
+            return np.unique(refs, return_counts=True)
+
+        cocited, inverse = np.unique(refs, return_inverse=True)
+        strengths = np.bincount(inverse, weights=np.repeat(weights, self.graph.num_references(citations)))
+        return cocited, strengths / weights.sum()
+
+    def cache_stats(self):
+        """Hit and miss counters of the cache, None without a cache."""
+        return None if self.cache is None else self.cache.stats()
+
+    def indexed(self):
+        """
+        Whether the co-citation index has the variant this allocator needs,
+        built from the importance it gives the papers now.
+        """
+        if self.index is None:
+            return False
+        if self.WEIGHTS is None:
+            return True
+        if self.weighted is None:
+            weights = self.importance(np.arange(len(self.graph)))
+            self.weighted = self.index.has_weights(self.WEIGHTS, weights)
+            if not self.weighted and self.index.data(self.WEIGHTS) is not None:
+                print('The {0} co-citation strengths were built from other weights, '
+                      'traversing the graph instead'.format(self.WEIGHTS))
+        return self.weighted
+
+    def importance(self, citing):
+        """
+        Importance of each citing paper, i.e. the weight its references add
+        to the co-citation strengths. None weighs all citing papers equally.
+        """
+        return None
+
+    def allocate_many(self, indices, batch_size=1024):
+        """
+        Allocates the credit of many papers at once. Returns a DataFrame with
+        columns paper, author and credit, one row per author of each paper in
+        indices. Multi-author papers that are never cited get NaN credits.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        frames = [self.allocate_batch(indices[start:start + batch_size])
+                  for start in range(0, len(indices), batch_size)]
+        if not frames:
+            return pd.DataFrame({'paper': [], 'author': [], 'credit': []})
+        return pd.concat(frames, ignore_index=True)
+
+    def allocate_batch(self, batch):
+        """allocate_many on a single batch of paper ids."""
+        graph = self.graph
+        rows = np.arange(len(batch))
+
+        # strengths (batch x papers) times credit allocation (papers x
+        # authors)
+        creds = self.batch_strengths(batch).dot(self.credit_mat)
+
+        # keep the credit every target gives its own authors
+        num_auths = graph.num_authors(batch)
+        papers = np.repeat(rows, num_auths)
+        authors = gather(graph.auth_ptr, graph.auth_idx, batch)
+        credits = np.zeros(len(authors))
+        if len(authors):
+            credits = np.asarray(creds[papers, authors], dtype=float).ravel()
+
+        totals = np.bincount(papers, weights=credits, minlength=len(batch))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            credits = credits / totals[papers]
+        credits[num_auths[papers] == 1] = 1.0
+        return pd.DataFrame({'paper': batch[papers], 'author': authors, 'credit': credits})
+
+    def batch_strengths(self, batch):
+        """
+        Sparse len(batch) x m co-citation strengths of the papers in batch,
+        up to a factor per row, read from the index if it is there.
+        """
+        graph = self.graph
+        rows = np.arange(len(batch))
+        if self.indexed():
+            index = self.index
+            cocited = gather(index.ptr, index.idx, batch)
+            strengths = gather(index.ptr, index.data(self.WEIGHTS), batch)
+            return sparse.csr_matrix((strengths, (np.repeat(rows, index.ptr[batch + 1] - index.ptr[batch]), cocited)),
+                                     shape=(len(batch), graph.m))
+
+        # citing papers of every target, then their references (the
+        # cocited papers), both labelled with the row of the target
+        citing = gather(graph.cit_ptr, graph.cit_idx, batch)
+        citing_rows = np.repeat(rows, graph.num_citations(batch))
+        num_refs = graph.num_references(citing)
+        cocited = gather(graph.ref_ptr, graph.ref_idx, citing)
+
+        weights = self.importance(citing)
+        if weights is None:
+            weights = np.ones(len(citing))
+
+        # duplicate entries of the coo input are summed up
+        return sparse.csr_matrix((np.repeat(weights, num_refs), (np.repeat(citing_rows, num_refs), cocited)),
+                                 shape=(len(batch), graph.m))
+
     def get_credit_allocation_mat(self, authors, cocited):
-        mat = []
-        for cc in cocited:
-            cocited_authors = set(self.nodes[cc].authors)
-            ratio_credit = 1.0 / len(cocited_authors)
-            creds = [ratio_credit if auth in cocited_authors else 0 for auth in authors]
-            mat.append(creds)
-        return mat
+        """
+        Sparse |cocited| x |authors| matrix of the credit every cocited paper
+        gives each of the authors, sliced from the global credit matrix.
+        """
+        rows = np.fromiter(cocited, dtype=np.int64, count=len(cocited))
+        return self.credit_mat[rows][:, authors]
 
 
 class SimpleImportanceBased(Shen):
@@ -64,32 +222,10 @@ class SimpleImportanceBased(Shen):
     community.
     """
 
-    def allocate(self, ind):
-        node = self.nodes[ind]
-        authors = node.authors
-        if len(authors) == 1:
-            return authors, [1.0]
+    WEIGHTS = 'indegree'
 
-        citations = node.citations
-
-        total_scores = 0
-        importances = dict()
-        for c in citations:
-            refs = self.nodes[c].references
-            score = len(self.nodes[c].citations)
-            for ref in refs:
-                if ref in importances:
-                    importances[ref] += score
-                else:
-                    importances[ref] = score
-            total_scores += score
-
-        cocited = set(importances.keys())
-        strengths = np.array([importances[c] / total_scores for c in cocited])
-
-        creds_mat = np.array(self.get_credit_allocation_mat(authors, cocited))
-        creds = np.matmul(strengths, creds_mat)
-        return authors, creds / sum(creds)
+    def importance(self, citing):
+        return self.graph.num_citations(citing).astype(float)
 
 
 class PRImportanceBased(Shen):
@@ -99,104 +235,352 @@ class PRImportanceBased(Shen):
     appropriate to the PageRank score the document earned in the community.
     """
 
-    def __init__(self):
-        super(PRImportanceBased, self).__init__()
-        self.scores = pd.read_csv('pagerank.csv')
+    WEIGHTS = 'pagerank'
 
-    def allocate(self, ind):
-        node = self.nodes[ind]
-        authors = node.authors
-        if len(authors) == 1:
-            return authors, [1.0]
+    def __init__(self, path=GRAPH, scores='pagerank', damping=0.85, cache_bytes=None):
+        """
+        Reads the PageRank scores from the scores table (see read_table), or
+        computes them in process with the given damping if scores is None.
+        """
+        super(PRImportanceBased, self).__init__(path, cache_bytes)
+        if scores is None:
+            self.scores = pagerank(self.graph, damping=damping).scores
+        else:
+            # dense array indexed by article id
+            table = read_table(scores)
+            self.scores = np.zeros(len(self.graph))
+            self.scores[table.i.values] = table.pr.values
 
-        citations = node.citations
-
-        total_scores = 0
-        importances = dict()
-        for c in citations:
-            refs = self.nodes[c].references
-            score = float(self.scores[self.scores.i == c].pr)
-            for ref in refs:
-                if ref in importances:
-                    importances[ref] += score
-                else:
-                    importances[ref] = score
-            total_scores += score
-
-        cocited = set(importances.keys())
-        strengths = np.array([importances[c] / total_scores for c in cocited])
-
-        creds_mat = np.array(self.get_credit_allocation_mat(authors, cocited))
-        creds = np.matmul(strengths, creds_mat)
-        return authors, creds / sum(creds)
+    def importance(self, citing):
+        return self.scores[citing]
 
 
 class IntrinsicCredit():
-    def __init__(self):
-        with open('citnodes.db', 'rb') as fd:
-            self.nodes = pickle.load(fd)
-
-        authors = pd.read_csv('authors.csv')
-        self.m = len(self.nodes)
-        self.n = authors.shape[0]
-
-        # credit, indicator, strength matrices
-        self.C = np.zeros((self.n, self.m))
-        self.B = np.ones((self.n, self.m))
-        self.S = np.zeros((self.m, self.m))
-
-    def build_matrices(self):
-        for i in range(self.m):
-            print(i)
-
-            node = self.nodes[i]
-            authors = node.authors
-            if authors:
-                cred = 1.0 / len(authors)
-                for a in authors:
-                    self.B[a][i] = 0
-                    self.C[a][i] = cred
-
-            citations = node.citations
-            cooccurence = []
-            for c in citations:
-                refs = self.nodes[c].references
-                cooccurence += list(refs)
-
-            cocited = set(cooccurence)
-            for k in cocited:
-                self.S[k][i] = cooccurence.count(k)
-
-    def compute(self, exact=True, alpha=0.1, num_iter=100, epsilon=1.0e-10):
+    """
+    Credits C solving C (S - I)(S - I)^T = -B, where S holds the co-citation
+    strengths between papers and B is 0 where an author wrote a paper and 1
+    elsewhere. The exact solver forms the dense matrices and takes a pseudo
+    inverse, which only works on small graphs. The iterative one keeps S
+    sparse: since B = 1 - P for the author x paper indicator P and
+    M = pinv((S - I)(S - I)^T) is symmetric,
+
+        C[a, i] = -(M 1)[i] + sum_{j in papers(a)} (M e_i)[j],
+
+    so the credits of one paper take two solves with D = S - I, and the
+    first one, u = M 1, is shared by all papers. D is factored once with a
+    sparse LU, after which a solve is a pair of triangular solves; only if
+    D is singular beyond its zero rows do the solves fall back to LSQR.
+    """
+
+    def __init__(self, path=GRAPH, verbose=False):
+        self.graph = CitGraph(path)
+        # print the outcome of every LSQR solve
+        self.verbose = verbose
+
+        self.m = len(self.graph)
+        self.n = self.graph.n
+
+        # credit, indicator, strength matrices; C and B are dense and only
+        # built by the exact solver
+        self.C = None
+        self.B = None
+        self.S = None
+        self.D = None
+        self.P = None
+        self.R = None
+
+        # sparse LU of D restricted to its nonzero rows and columns, which
+        # are listed in keep
+        self.lu = None
+        self.keep = None
+
+        # settings of the iterative solver, and its solutions of both
+        # least-squares problems for u = M 1
+        self.alpha = 0.0
+        self.num_iter = None
+        self.epsilon = 1.0e-12
+        self.solution = None
+        self.u = None
+
+    def build_matrices(self, incremental=True):
+        """
+        Sparse strengths S = R^T R, R being the citing x cited reference
+        matrix, so S[k, i] counts the papers citing both k and i, and the
+        author x paper indicator P. S is read from the co-citation index if
+        it has been built. R and S are kept in matrices.db next to the
+        graph; when it exists and incremental is set, they are carried over
+        to the ids of this graph (see carry_over) and only the rows of R
+        that changed since (e.g. after a monthly update of the graph) go
+        into S, as S += R'[rows]^T R'[rows] - R[rows]^T R[rows]. Returns
+        those rows, or None if the matrices were built from scratch.
+        """
+        graph = self.graph
+        refs = sparse.csr_matrix((np.ones(len(graph.ref_idx)), graph.ref_idx, graph.ref_ptr),
+                                 shape=(self.m, self.m))
+        authorship = sparse.csr_matrix((np.ones(len(graph.auth_idx)), graph.auth_idx, graph.auth_ptr),
+                                       shape=(self.m, self.n))
+        self.P = authorship.T.tocsr()
+
+        rows = None
+        matrices = self.load('matrices.db') if incremental else None
+        if matrices is not None:
+            old, self.S = matrices['R'], matrices['S']
+            carry = self.carry_over(matrices)
+
+            # citing papers gone from this graph take their co-citations along
+            gone = np.flatnonzero(np.diff(carry.tocsc().indptr) == 0)
+            if len(gone):
+                self.S = self.S - old[gone].T.dot(old[gone])
+            old = carry.dot(old).dot(carry.T).tocsr()
+            self.S = carry.dot(self.S).dot(carry.T).tocsr()
+
+            rows = np.unique((refs != old).nonzero()[0])
+            print('{0} citing papers changed'.format(len(rows)))
+
+            before, after = old[rows], refs[rows]
+            self.S = (self.S + after.T.dot(after) - before.T.dot(before)).tocsr()
+            self.S.eliminate_zeros()
+        else:
+            index = open_index(graph)
+            if index is not None:
+                self.S = sparse.csr_matrix((index.cnt.astype(float), index.idx, index.ptr), shape=(self.m, self.m))
+            else:
+                self.S = refs.T.dot(refs).tocsr()
+
+        self.R = refs
+        self.D = (self.S - sparse.identity(self.m)).tocsr()
+        self.save('matrices.db', {'R': self.R, 'S': self.S})
+        return rows
+
+    def carry_over(self, stored):
+        """
+        Sparse m x m' matrix Q taking the m' articles of the graph stored
+        was saved for to the articles of this one, so Q x and Q A Q^T carry
+        vectors and matrices over. Articles are matched by DOI, as ingest
+        numbers them journal by journal and a new article shifts the ids of
+        every later journal; without DOIs on either side, by id, assuming
+        the old articles kept theirs. Articles of neither graph are dropped.
+        """
+        dois = self.graph.dois()
+        if dois is None or stored.get('dois') is None:
+            old_ids = np.arange(min(stored['m'], self.m))
+            new_ids = old_ids
+        else:
+            old = stored['dois']
+            matched = pd.merge(pd.DataFrame({'old': old.id.values, 'doi': np.asarray(old.doi, dtype=object)}),
+                               pd.DataFrame({'new': dois.id.values, 'doi': np.asarray(dois.doi, dtype=object)}),
+                               on='doi')
+            old_ids, new_ids = matched.old.values, matched.new.values
+        return sparse.csr_matrix((np.ones(len(old_ids)), (new_ids, old_ids)), shape=(self.m, stored['m']))
+
+    def load(self, name):
+        """
+        The dict stored by save under name next to the graph, or None if
+        it is missing, or was stored without DOIs for a graph with more
+        articles, i.e. one this graph cannot have grown from by id.
+        """
+        file = os.path.join(self.graph.path, name)
+        if not os.path.exists(file):
+            return None
+        with open(file, 'rb') as fd:
+            stored = pickle.load(fd)
+        if not isinstance(stored, dict) or 'm' not in stored or \
+                (stored.get('dois') is None and stored['m'] > self.m):
+            print('{0} does not belong to this graph, starting from scratch'.format(file))
+            return None
+        if (stored['m'], stored['edges']) != (self.m, len(self.graph.ref_idx)):
+            print('{0} is from a graph of {1} articles and {2} references, carrying it over'.format(
+                file, stored['m'], stored['edges']))
+        return stored
+
+    def save(self, name, stored):
+        """Stores a dict under name next to the graph, with its size and DOIs."""
+        stored = dict(stored, m=self.m, edges=len(self.graph.ref_idx), dois=self.graph.dois())
+        with open(os.path.join(self.graph.path, name), 'wb') as fd:
+            pickle.dump(stored, fd)
+
+    def compute(self, exact=False, alpha=0.0, num_iter=None, epsilon=1.0e-12, warm_start=True):
+        """
+        Solves for the credits, exactly with a pseudo inverse or with a
+        sparse LU of D (see factor). The factors fill in: on random graphs
+        of 10 references per paper they are nearly dense, 3M nonzeros
+        taking 1 s at m = 2000 and 48M taking 37 s at m = 8000, after which
+        allocate takes 0.01 s and 0.14 s per paper. If D cannot be
+        factored, LSQR takes over, damped by alpha and stopped after
+        num_iter iterations (20 m if None) or once the relative residual is
+        below epsilon. Only alpha = 0 approximates the exact credits, and
+        only after about 10 m iterations per solve, e.g. 19k iterations and
+        8 s at m = 2000 and 84k iterations and 150 s at m = 8000, for
+        compute and again for every allocate. With warm_start, LSQR starts
+        from the solution stored in credit.db next to the graph.
+        """
         print('building matrices...')
         self.build_matrices()
         print('computing credits...')
 
-        d = self.S - np.identity(self.m)
-        ddt = np.matmul(d, np.matrix.transpose(d))
         if exact:
+            self.B = 1.0 - self.P.toarray()
+            d = self.D.toarray()
+            ddt = np.matmul(d, np.matrix.transpose(d))
             self.C = -np.matmul(self.B, pinv(ddt))
-            with open('credit.db', 'wb') as fd:
-                pickle.dump(self.C, fd)
+            self.save('credit.db', {'C': self.C})
+            return
+
+        self.alpha, self.num_iter, self.epsilon = alpha, num_iter, epsilon
+        self.lu = self.factor()
+
+        x0 = None
+        stored = self.load('credit.db') if warm_start and self.lu is None else None
+        if stored is not None and 'solution' in stored:
+            # zero for the papers added since
+            carry = self.carry_over(stored)
+            x0 = [carry.dot(x) for x in stored['solution']]
+
+        self.solution = self.solve(np.ones(self.m), x0, verbose=True)
+        self.u = self.solution[-1]
+        self.save('credit.db', {'solution': self.solution})
+
+    def factor(self, tol=1.0e-8):
+        """
+        Sparse LU of D without its zero rows, or None if that is singular.
+        D is symmetric, so a zero row i comes with a zero column i (paper i
+        is co-cited exactly once, with itself) and pinv(D D^T) maps e_i to
+        0; the rest of D is factored. Factors whose solve of D y = 1 leaves
+        a relative residual above tol are rejected as well.
+        """
+        d = self.D.copy()
+        d.eliminate_zeros()
+        self.keep = np.flatnonzero(np.diff(d.indptr) > 0)
+        d = d[self.keep][:, self.keep].tocsc()
+        try:
+            lu = splu(d, permc_spec='MMD_AT_PLUS_A')
+        except RuntimeError:
+            lu = None
+
+        if lu is not None:
+            b = np.ones(len(self.keep))
+            if np.linalg.norm(d.dot(lu.solve(b)) - b) > tol * np.linalg.norm(b):
+                lu = None
+        if lu is None:
+            print('D is singular, falling back to LSQR')
+            return None
+        print('factored D of {0} papers, {1} nonzeros in L and U'.format(len(self.keep), lu.L.nnz + lu.U.nnz))
+        return lu
+
+    def solve(self, b, x0=None, verbose=False):
+        """
+        pinv(D D^T) b = pinv(D^T) pinv(D) b, D being S - I, as two solves
+        with D and D^T: by the LU of D if compute factored it, otherwise by
+        LSQR least-squares solves, optionally started from the pair of
+        guesses x0. Returns the solutions of both; the last one is the
+        result. How LSQR stopped is printed if verbose or if the allocator
+        was made verbose, and a warning is raised if it stopped at the
+        iteration limit before converging.
+        """
+        if self.lu is not None:
+            solution = [np.zeros(self.m), np.zeros(self.m)]
+            solution[0][self.keep] = self.lu.solve(b[self.keep])
+            solution[1][self.keep] = self.lu.solve(solution[0][self.keep], trans='T')
+            return solution
+
+        num_iter = 20 * self.m if self.num_iter is None else self.num_iter
+        solution = []
+        x = b
+        for k, mat in enumerate([self.D, self.D.T]):
+            guess = None if x0 is None else x0[k]
+            x, istop, itn, r1norm = lsqr(self.damped(mat), np.concatenate([x, np.zeros(self.m)]),
+                                         atol=self.epsilon, btol=self.epsilon, iter_lim=num_iter,
+                                         x0=guess)[:4]
+            if verbose or self.verbose:
+                print('lsqr stopped ({0}) after {1} iterations, residual {2:.3e}'.format(istop, itn, r1norm))
+            if istop == 7:
+                warnings.warn('lsqr did not converge in {0} iterations (residual {1:.3e}), '
+                              'the credits are not final; raise num_iter'.format(itn, r1norm), RuntimeWarning)
+            solution.append(x)
+        return solution
+
+    def damped(self, mat):
+        """
+        The stacked operator [mat; alpha I]. Solving it in the least-squares
+        sense is LSQR's damped problem, but unlike lsqr(damp=alpha, x0=...)
+        the damping stays on x rather than on x - x0 when warm starting.
+        """
+        alpha = self.alpha
+        return LinearOperator((2 * self.m, self.m), dtype=float,
+                              matvec=lambda x: np.concatenate([mat.dot(x), alpha * x]),
+                              rmatvec=lambda y: mat.T.dot(y[:self.m]) + alpha * y[self.m:])
 
     def allocate(self, ind):
-        node = self.nodes[ind]
-        authors = node.authors
+        authors = self.graph.authors(ind)
 
-        if not authors:
+        if len(authors) == 0:
             return authors, []
 
         if len(authors) == 1:
             return authors, [1.0]
 
-        creds = [self.C[a][ind] for a in authors]
+        if self.C is not None:
+            creds = [self.C[a][ind] for a in authors]
+            return authors, creds
+
+        e = np.zeros(self.m)
+        e[ind] = 1.0
+        creds = self.P[authors].dot(self.solve(e)[-1]) - self.u[ind]
         return authors, creds
 
+def allocate_all(algo, indices):
+    """
+    Credits of the authors of the papers in indices as a DataFrame with
+    columns paper, author and credit, taken from allocate_many if the
+    algorithm has it and from allocate paper by paper otherwise.
+    """
+    if hasattr(algo, 'allocate_many'):
+        return algo.allocate_many(indices)
+
+    papers, authors, credits = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+    for ind in indices:
+        auths, creds = algo.allocate(ind)
+        papers.append(np.full(len(auths), ind, dtype=np.int64))
+        authors.append(np.asarray(auths, dtype=np.int64))
+        credits.append(np.asarray(creds, dtype=float))
+    return pd.DataFrame({'paper': np.concatenate(papers), 'author': np.concatenate(authors),
+                         'credit': np.concatenate(credits)})
+
+
+def write_report(algo, awardings, authors, path='alloc.csv'):
+    """
+    Writes the credit every author of the awarded papers receives, with the
+    author's name and nobelwinner flag looked up in arrays indexed by author
+    id. The format follows the extension of path: .parquet, .feather or
+    otherwise CSV.
+    """
+    indices = awardings.id.values.astype(np.int64)
+    table = allocate_all(algo, indices)
+
+    names = np.empty(int(authors.id.max()) + 1, dtype=object)
+    names[authors.id.values] = authors.name.values
+    nobels = np.zeros(len(names), dtype=authors.nobelwinner.dtype)
+    nobels[authors.id.values] = authors.nobelwinner.values
+
+    # one row per author of each awarding, in the order of awardings
+    rows = np.repeat(np.arange(len(awardings)), algo.graph.num_authors(indices))
+    auths = table.author.values
+    report = pd.DataFrame({'id': indices[rows], 'article': awardings.article.values[rows],
+                           'author': names[auths], 'credit': table.credit.values, 'nobelwinner': nobels[auths]})
+
+    ext = os.path.splitext(path)[1]
+    if ext == '.parquet':
+        report.to_parquet(path, index=False)
+    elif ext == '.feather':
+        report.to_feather(path)
+    else:
+        report.to_csv(path, index=False)
+
+
 if __name__ == '__main__':
     print('')
 
-    articles = pd.read_csv('articles.csv', usecols=['id', 'doi'])
-    authors = pd.read_csv('authors.csv')
+    authors = read_table('authors')
 
     # algo = Shen()
     # algo = SimpleImportanceBased()
@@ -205,17 +589,5 @@ if __name__ == '__main__':
     algo.compute()
 
     awardings = pd.read_csv('nobel.csv')
-    fmt = '{0},{1},{2},{3},{4}\n'
-    with open('alloc.csv', 'a+') as file:
-        file.write('id,article,author,credit,nobelwinner\n')
-        for k, row in awardings.iterrows():
-            print(row.article)
-            id = int(row.id)
-            auth_indices, credits = algo.allocate(id)
-            for i in range(len(auth_indices)):
-                auth = auth_indices[i]
-                found = authors[authors['id'] == auth]
-                name = found['name'].values[0]
-                nobel = found['nobelwinner'].values[0]
-                file.write(fmt.format(id, row.article, name, credits[i], nobel))
-
+    # alloc.csv, alloc.parquet or alloc.feather
+    write_report(algo, awardings, authors, sys.argv[1] if len(sys.argv) > 1 else 'alloc.csv')
@@ -3,155 +3,352 @@
 # Copyright (C) 2018 Chunheng Jiang (jiangchunheng@gmail.com)
 # Created at 5:59 PM Mar 20, 2018
 
-import xmltodict
-
+import csv
+import gc
+import glob
+import hashlib
+import os
 import pickle
+import sys
 
-import pandas as pd
 from collections import OrderedDict
 
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
 DATABASE = '/Users/chjiang/GitHub/data/aps/'
+GRAPH = 'citgraph'
+JOURNALS = 'PR,PRA,PRB,PRC,PRD,PRE,PRI,PRL,PRSTAB,PRSTPER,RMP'.split(',')
+NAMES = ['givenname', 'middlename', 'surname']
+
+# format of the intermediate tables, 'feather' or 'csv'
+TABLE_FORMAT = 'feather'
+
+# types of the columns of the intermediate tables, wherever they appear
+COLUMN_TYPES = {
+    'id': np.int32,
+    'article': np.int32,
+    'author': np.int32,
+    'numauth': np.int32,
+    'i': np.int32,
+    'doi': 'category',
+    'journal': 'category',
+    'citing_doi': 'category',
+    'cited_doi': 'category',
+}
+
+
+def typed(table):
+    """table with its columns cast to COLUMN_TYPES."""
+    types = {column: COLUMN_TYPES[column] for column in table.columns if column in COLUMN_TYPES}
+    return table.astype(types)
+
+
+def write_table(table, name, fmt=TABLE_FORMAT):
+    """
+    Writes table to name.feather, an uncompressed Arrow file that
+    read_table maps into memory, or to name.csv if fmt is 'csv'.
+    """
+    table = typed(table)
+    if fmt == 'csv':
+        table.to_csv(name + '.csv', index=False)
+    else:
+        table.reset_index(drop=True).to_feather(name + '.feather', compression='uncompressed')
+
+
+def read_table(name, columns=None):
+    """
+    Reads the table written by write_table under name, from name.feather
+    if it is there and from name.csv otherwise. name may also be the path
+    of either file.
+    """
+    root, ext = os.path.splitext(name)
+    if ext not in ('.feather', '.csv'):
+        root, ext = name, '.feather' if os.path.exists(name + '.feather') else '.csv'
+
+    if ext == '.feather':
+        from pyarrow import feather
+        return feather.read_table(root + ext, columns=columns, memory_map=True).to_pandas()
+    return typed(pd.read_csv(root + ext, usecols=columns))
+
+
+def export_csv(name):
+    """Writes the table under name as name.csv as well."""
+    write_table(read_table(name), name, 'csv')
+
+
+def convert_csv(name, fmt=TABLE_FORMAT):
+    """Replaces name.csv by the table in format fmt, if that is not CSV."""
+    if fmt == 'csv':
+        return
+    write_table(pd.read_csv(name + '.csv'), name, fmt)
+    os.remove(name + '.csv')
 
 
 class Author(object):
+    """
+    An author as named in the APS metadata. Two authors are the same if
+    they share the key: the initials of the given and middle names and the
+    surname, title cased. The key is computed once and interned.
+    """
+
+    __slots__ = ('given', 'middle', 'surname', 'id', 'key')
+
     def __init__(self, given, middle, surname):
         self.given = given
         self.middle = middle
         self.surname = surname
         self.id = -1
+        self.key = author_key(given, middle, surname)
 
     def __str__(self):
         nms = self.features()
         return ' '.join(nms)
 
     def __hash__(self):
-        nms = self.features()
-        return hash((nms[0], nms[1], nms[2]))
+        return hash(self.key)
 
     def features(self):
-        f = []
-        if self.given:
-            f.append(self.given[0].title())
-        else:
-            f.append('')
-        if self.middle:
-            f.append(self.middle[0].title())
-        else:
-            f.append('')
-
-        if self.surname:
-            f.append(self.surname.title())
-        else:
-            f.append('')
-        return f
+        return self.key.split(KEY_SEP)
 
     def __eq__(self, other):
-        return self.features() == other.features()
+        return self.key == other.key
+
+
+# separates the features in author keys, never part of a sorted out name
+KEY_SEP = '\x1f'
+
+
+def author_key(given, middle, surname):
+    """Interned key of an author, see Author."""
+    key = KEY_SEP.join([given[0].title() if given else '', middle[0].title() if middle else '',
+                        surname.title() if surname else ''])
+    return sys.intern(key)
+
+
+def author_keys(table):
+    """
+    author_key over the given, middle and surname columns of table, by
+    vectorized string operations. Returns a Series of keys.
+    """
+    given = table['given'].str[:1].str.title()
+    middle = table['middle'].str[:1].str.title()
+    surname = table['surname'].str.title()
+    return given + KEY_SEP + middle + KEY_SEP + surname
+
+
+class _NameTable(dict):
+    """
+    str.translate table dropping digits and daggers and turning commas into
+    spaces. Digits are resolved, and remembered, on first sight, as
+    str.isdigit covers many code points beyond 0-9.
+    """
+
+    def __init__(self):
+        super(_NameTable, self).__init__({ord('†'): None, ord(','): ' '})
+
+    def __missing__(self, code):
+        value = None if chr(code).isdigit() else code
+        self[code] = value
+        return value
+
+
+NAME_TABLE = _NameTable()
+
+
+def iter_aps(xml):
+    """
+    Streams the articles of an APS metadata dump, yielding one
+    (doi, printdate, group) triple per article, where group lists the raw
+    [given, middle, surname] names of its authors. Every article is released
+    once it has been read, so memory stays flat however large the dump is.
+    """
+    depth = 0
+    context = ElementTree.iterparse(xml, events=('start', 'end'))
+    for event, elem in context:
+        if event == 'start':
+            if depth == 0:
+                root = elem
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth != 1 or elem.tag != 'article':
+            continue
+
+        group = []
+        for authgrp in elem.findall('authgrp'):
+            for auth in authgrp.findall('author'):
+                group.append([_joined_text(auth, name) for name in NAMES])
+        issue = elem.find('issue')
+        printdate = _joined_text(issue, 'printdate') if issue is not None else ''
+        yield _joined_text(elem, 'doi'), printdate, group
+        root.clear()
+
+
+def _joined_text(elem, tag):
+    """Text of the tag children of elem, joined by spaces if repeated."""
+    texts = [''.join(child.itertext()).strip() for child in elem.findall(tag)]
+    return ' '.join([text for text in texts if text])
 
 
 class CitNet(object):
     def __init__(self):
-        self.authorship = []
         self.authbook = dict()
         self.authtable = []
-        self.file_cit_net = DATABASE + 'citing_cited.csv'
-
-    def parse_aps(self):
-        journals = 'PR,PRA,PRB,PRC,PRD,PRE,PRI,PRL,PRSTAB,PRSTPER,RMP'.split(',')
-        num_articles, num_authors = 0, 0
-        with open('articles2.csv', 'w+') as ostream:
-            ostream.write('id,doi,journal,numauth\n')
-
-            for journal in journals:
-                xml = DATABASE + journal + '.xml'
-                file = open(xml)
-                doc = xmltodict.parse(file.read())
-                entries = doc['articles']['article']
-                for entry in entries:
-                    doi = entry['doi']
-
-                    authgroup = []
-
-                    # no author
-                    if 'authgrp' not in entry:
-                        continue
-
-                    group = []
-                    if isinstance(entry['authgrp'], list):
-                        for g in entry['authgrp']:
-                            if 'author' not in g:
-                                continue
-
-                            if isinstance(g['author'], OrderedDict):
-                                group.append(g['author'])
-                            elif isinstance(g['author'], list):
-                                for c in g['author']:
-                                    group.append(c)
-                    elif isinstance(entry['authgrp'], OrderedDict):
-                        if 'author' not in entry['authgrp']:
-                            continue
-
-                        auth = entry['authgrp']['author']
-                        if isinstance(auth, OrderedDict):
-                            group.append(auth)
-                        elif isinstance(auth, list):
-                            for a in auth:
-                                group.append(a)
-
-                    for auth in group:
-                        names = ['givenname', 'middlename', 'surname']
-                        for i in range(len(names)):
-                            name = names[i]
-                            if name in auth:
-                                name = auth[name]
-                                if not name:
-                                    names[i] = ''
-                                elif isinstance(name, list):  # name may be a list
-                                    name = [n for n in name if n is not None]
-                                    names[i] = ' '.join(name)
-                                else:
-                                    names[i] = name
-                            else:
-                                names[i] = ''
-
-                        names = self.sort_out_names(names)
-                        noname = sum([1 for name in names if name == ''])
-                        if noname == len(names):
-                            continue
-
-                        author = Author(*names)
-                        if author in self.authbook:
-                            ind = self.authbook[author]
-                            authgroup.append(self.authtable[ind])
-                            continue
-
-                        author.id = num_authors
-                        authgroup.append(author)
-                        self.authtable.append(author)
-                        self.authbook[author] = num_authors
-                        num_authors += 1
-
-                    if not authgroup:
-                        continue
-
-                    print(num_articles, journal)
-                    printdate = ''
-                    if 'issue' in entry:
-                        printdate = entry['issue']['printdate']
-                        len = len(printdate)
-                        if len > 4 and '-' in printdate:
-                            ind = printdate.index('-')
-                            printdate = printdate[:ind]
-                    ostream.write('{0},{1},{2},{3},{4}\n'.format(num_articles, doi, printdate, journal, len(authgroup)))
+        self.file_cit_net = DATABASE + 'citing_cited'
+
+    def parse_aps(self, processes=1, parts='aps_parts', fmt=TABLE_FORMAT):
+        """
+        Parses all journals into the articles2, authorship and authors
+        tables, in format fmt (see write_table). With processes > 1 the
+        journals are parsed in a process pool, each worker writing partial
+        tables with journal-local ids under parts, and merge_journals then
+        assigns the global ids in the same order a serial run does, so the
+        output is identical.
+        """
+        if processes > 1:
+            if not os.path.exists(parts):
+                os.makedirs(parts)
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                jobs = [(journal, parts) for journal in JOURNALS]
+                for journal, num_articles, num_authors in pool.map(_parse_journal, jobs):
+                    print(journal, num_articles, num_authors)
+            self.merge_journals(parts)
+        else:
+            self.parse_journals()
+
+        # the tables are streamed to CSV while parsing, then typed
+        for name in ['articles2', 'authorship']:
+            convert_csv(name, fmt)
+        self.dump_authors(fmt)
+
+    def parse_journals(self):
+        """Parses all journals one after the other, see parse_aps."""
+        num_articles = 0
+        with open('articles2.csv', 'w+') as ostream, open('authorship.csv', 'w+') as authstream:
+            ostream.write('id,doi,year,journal,numauth\n')
+            authstream.write('article,author\n')
+
+            for journal in JOURNALS:
+                for doi, year, authgroup in self.iter_journal(journal):
+                    authids = [self.register(author) for author in authgroup]
+                    ostream.write('{0},{1},{2},{3},{4}\n'.format(num_articles, doi, year, journal, len(authids)))
 
                     # recording the authorship
-                    for author in authgroup:
-                        self.authorship.append([num_articles, author.id])
+                    for authid in authids:
+                        authstream.write('{0},{1}\n'.format(num_articles, authid))
                     num_articles += 1
-                file.close()
-
-        # self.dump_authors()
-        # self.dump_authorship()
+                print(num_articles, journal)
+
+    def iter_journal(self, journal):
+        """
+        Yields (doi, year, authgroup) for every article of journal with at
+        least one named author, authgroup being a list of new Author objects.
+        """
+        xml = DATABASE + journal + '.xml'
+        for doi, printdate, group in iter_aps(xml):
+            authgroup = []
+            for names in group:
+                names = self.sort_out_names(names)
+                noname = sum([1 for name in names if name == ''])
+                if noname == len(names):
+                    continue
+                authgroup.append(Author(*names))
+
+            if not authgroup:
+                continue
+
+            if len(printdate) > 4 and '-' in printdate:
+                ind = printdate.index('-')
+                printdate = printdate[:ind]
+            yield doi, printdate, authgroup
+
+    def register(self, author):
+        """Returns the id of author, assigning the next one if it is new."""
+        authid = self.authbook.get(author.key)
+        if authid is not None:
+            return authid
+
+        author.id = len(self.authtable)
+        self.authtable.append(author)
+        self.authbook[author.key] = author.id
+        return author.id
+
+    def register_table(self, table):
+        """
+        Ids of the authors in the rows of table, with columns given, middle
+        and surname, as register assigns them row by row. The keys are
+        computed in bulk and joined against the authors seen so far.
+        """
+        keys = author_keys(table)
+        ids = keys.map(self.authbook)
+        new = ids.isnull().values
+        if new.any():
+            # a key repeated within table gets the id of its first row
+            fresh = keys[new].drop_duplicates()
+            first = len(self.authtable)
+            rows = table.loc[fresh.index]
+            for i, (given, middle, surname) in enumerate(zip(rows['given'], rows['middle'], rows['surname'])):
+                author = Author(given, middle, surname)
+                author.id = first + i
+                self.authtable.append(author)
+                self.authbook[author.key] = author.id
+            ids = keys.map(self.authbook)
+        return ids.values.astype(np.int64)
+
+    def parse_journal(self, journal, parts):
+        """
+        Parses one journal into partial article, author and authorship
+        tables under parts, numbering articles and authors from 0 in the
+        order they first appear in the journal.
+        """
+        prefix = os.path.join(parts, journal)
+        num_articles = 0
+        with open(prefix + '_articles.csv', 'w+', newline='') as ostream, \
+                open(prefix + '_authorship.csv', 'w+', newline='') as authstream:
+            articles = csv.writer(ostream)
+            authorship = csv.writer(authstream)
+            for doi, year, authgroup in self.iter_journal(journal):
+                authids = [self.register(author) for author in authgroup]
+                articles.writerow([doi, year, len(authids)])
+                authorship.writerows([[num_articles, authid] for authid in authids])
+                num_articles += 1
+
+        with open(prefix + '_authors.csv', 'w+', newline='') as file:
+            authors = csv.writer(file)
+            authors.writerows([[a.given, a.middle, a.surname] for a in self.authtable])
+        return journal, num_articles, len(self.authtable)
+
+    def merge_journals(self, parts):
+        """
+        Merges the partial tables written by parse_journal, journal by
+        journal in JOURNALS order, into the global tables.
+        """
+        num_articles = 0
+        with open('articles2.csv', 'w+') as ostream, open('authorship.csv', 'w+') as authstream:
+            ostream.write('id,doi,year,journal,numauth\n')
+            authstream.write('article,author\n')
+
+            for journal in JOURNALS:
+                prefix = os.path.join(parts, journal)
+                names = pd.read_csv(prefix + '_authors.csv', names=['given', 'middle', 'surname'],
+                                    dtype=str, keep_default_na=False)
+                authids = self.register_table(names)
+
+                offset = num_articles
+                with open(prefix + '_articles.csv', newline='') as file:
+                    for doi, year, numauth in csv.reader(file):
+                        ostream.write('{0},{1},{2},{3},{4}\n'.format(num_articles, doi, year, journal, numauth))
+                        num_articles += 1
+
+                with open(prefix + '_authorship.csv', newline='') as file:
+                    for article, author in csv.reader(file):
+                        authstream.write('{0},{1}\n'.format(offset + int(article), authids[int(author)]))
+                print(num_articles, journal)
 
     def sort_out_names(self, names):
         if names[2] == 'Jr.':
@@ -167,51 +364,469 @@ class CitNet(object):
         for i in range(len(names)):
             name = names[i]
             if name:
-                name = ''.join([_ for _ in name if not _.isdigit()])
-                name = name.replace('†', '').replace('@f', '')
-                name = name.replace(',', ' ').strip()
+                name = name.translate(NAME_TABLE).replace('@f', '')
                 names[i] = ' '.join(name.split())
         return names
 
-    def dump_authors(self):
-        with open('authors.csv', 'w+') as file:
-            file.write('id,given,middle,surname,name\n')
-            fmt = '{0},{1},{2},{3},{4}\n'
-            for author in self.authbook.keys():
-                line = fmt.format(author.id, author.given, author.middle, author.surname, str(author))
-                file.write(line)
-
-    def dump_authorship(self):
-        with open('authorship.csv', 'w+') as file:
-            file.write('article,author\n')
-            for article, author in self.authorship:
-                file.write('{0},{1}\n'.format(article, author))
+    def dump_authors(self, fmt=TABLE_FORMAT):
+        authors = pd.DataFrame({'id': [author.id for author in self.authtable],
+                                'given': [author.given for author in self.authtable],
+                                'middle': [author.middle for author in self.authtable],
+                                'surname': [author.surname for author in self.authtable],
+                                'name': [str(author) for author in self.authtable]},
+                               columns=['id', 'given', 'middle', 'surname', 'name'])
+        write_table(authors, 'authors', fmt)
 
     def parse_nodes(self):
-        articles = pd.read_csv('articles.csv', usecols=['id', 'doi'])
-        indicies_doi = dict(zip(articles.doi, articles.id))
-
-        net = pd.read_csv(self.file_cit_net)
-        references = dict(net.groupby('citing_doi')['cited_doi'].apply(list))
-        citations = dict(net.groupby('cited_doi')['citing_doi'].apply(list))
-
-        authorship = pd.read_csv('authorship.csv')
-        authors = dict(authorship.groupby('article')['author'].apply(list))
-
+        """
+        Pickles the CitNode of every article to citnodes.db, built from the
+        CSR arrays of the references, citations and authors in bulk.
+        Articles without authorship rows get an empty author list.
+        """
+        articles = self.load_articles()
+        citing, cited = self.load_edges(articles)
+        m = int(articles.id.max()) + 1
+        ref_ptr, ref_idx = edges_to_csr(citing, cited, m)
+        cit_ptr, cit_idx = edges_to_csr(cited, citing, m)
+
+        authorship = read_table('authorship')
+        authorship = authorship[authorship.article < m]
+        auth_ptr, auth_idx = to_csr(authorship.article.values, authorship.author.values, m)
+
+        ids = articles.id.values
+        num_auths = auth_ptr[ids + 1] - auth_ptr[ids]
+        if (num_auths == 0).any():
+            print('{0} of {1} articles have no authors'.format(int((num_auths == 0).sum()), len(ids)))
+
+        # python lists sliced per article, rather than numpy slices, and
+        # no cycle collection, which would scan the nodes again and again
+        refs, cits, auths = ref_idx.tolist(), cit_idx.tolist(), auth_idx.tolist()
+        ref_ptr, cit_ptr, auth_ptr = ref_ptr.tolist(), cit_ptr.tolist(), auth_ptr.tolist()
         nodes = {}
-        for i in range(articles.shape[0]):
-            article = articles.iloc[i]
-            node = CitNode()
-            doi = article.doi
-            node.authors = authors[article.id]
-            if doi in references:
-                node.references = set([indicies_doi[r] for r in references[doi] if r in indicies_doi])
-            if doi in citations:
-                node.citations = set([indicies_doi[c] for c in citations[doi] if c in indicies_doi])
-            nodes[indicies_doi[doi]] = node
+        gc.disable()
+        try:
+            for i in ids.tolist():
+                node = CitNode()
+                node.authors = auths[auth_ptr[i]:auth_ptr[i + 1]]
+                node.references = set(refs[ref_ptr[i]:ref_ptr[i + 1]])
+                node.citations = set(cits[cit_ptr[i]:cit_ptr[i + 1]])
+                nodes[i] = node
+        finally:
+            gc.enable()
 
         with open('citnodes.db', 'wb') as fd:
-            pickle.dump(nodes, fd)
+            pickle.dump(nodes, fd, pickle.HIGHEST_PROTOCOL)
+
+    def parse_graph(self, path=GRAPH):
+        """
+        Builds the CSR citation graph (see CitGraph) from the article,
+        citation and authorship tables and saves it under path.
+        """
+        articles = self.load_articles()
+        citing, cited = self.load_edges(articles)
+
+        m = int(articles.id.max()) + 1
+        authorship = read_table('authorship').drop_duplicates()
+        known = authorship.article < m
+        if not known.all():
+            print('Dropped {0} of {1} authorship rows of unknown articles'.format(
+                len(known) - int(known.sum()), len(known)))
+        authorship = authorship[known]
+        n = int(authorship.author.max()) + 1
+        CitGraph.dump(path, m, n, citing, cited,
+                      authorship.article.values, authorship.author.values, dois=articles)
+
+    def load_articles(self):
+        """Ids and DOIs of the articles, the last id of a repeated DOI."""
+        articles = read_table('articles', columns=['id', 'doi'])
+        return articles.drop_duplicates('doi', keep='last')
+
+    def load_edges(self, articles):
+        """
+        Citing and cited article ids of the edges of the citation table.
+        The DOIs are categorical, so each distinct DOI is looked up once and
+        the edges take the ids of their category codes. Edges with a DOI
+        missing from articles are dropped and reported.
+        """
+        indices_doi = pd.Series(articles.id.values.astype(np.int64),
+                                index=np.asarray(articles.doi, dtype=object))
+
+        net = read_table(self.file_cit_net)
+        ids, unknown = [], []
+        for column in ['citing_doi', 'cited_doi']:
+            dois = net[column].astype('category')
+            # an extra -1 at the end for the code -1 of missing values
+            lookup = indices_doi.reindex(dois.cat.categories).fillna(-1).values.astype(np.int64)
+            lookup = np.append(lookup, -1)
+            codes = dois.cat.codes.values
+            ids.append(lookup[codes])
+
+            used = np.zeros(len(lookup), dtype=bool)
+            used[codes] = True
+            unknown.append(dois.cat.categories[used[:-1] & (lookup[:-1] < 0)])
+        citing, cited = ids
+
+        known = (citing >= 0) & (cited >= 0)
+        num_unknown = len(unknown[0].union(unknown[1]))
+        if not known.all():
+            print('Dropped {0} of {1} citations for {2} unknown DOIs'.format(
+                len(known) - int(known.sum()), len(known), num_unknown))
+        return citing[known], cited[known]
+
+
+class CitGraph(object):
+    """
+    Citation network held in compressed sparse row (CSR) arrays. Article i
+    references ref_idx[ref_ptr[i]:ref_ptr[i + 1]], is cited by
+    cit_idx[cit_ptr[i]:cit_ptr[i + 1]] and is written by the authors in
+    auth_idx[auth_ptr[i]:auth_ptr[i + 1]]. Every array is saved as a .npy
+    file and opened memory-mapped, so nothing is read before it is used and
+    the pages are shared by all processes working on the same graph.
+    """
+    ARRAYS = ['ref_ptr', 'ref_idx', 'cit_ptr', 'cit_idx', 'auth_ptr', 'auth_idx']
+
+    def __init__(self, path=GRAPH, mmap_mode='r'):
+        self.path = path
+        for name in self.ARRAYS:
+            array = np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+            setattr(self, name, array)
+
+        # number of articles and authors
+        self.m, self.n = [int(x) for x in np.load(os.path.join(path, 'shape.npy'))]
+
+    def __len__(self):
+        return self.m
+
+    def references(self, i):
+        return self.ref_idx[self.ref_ptr[i]:self.ref_ptr[i + 1]]
+
+    def citations(self, i):
+        return self.cit_idx[self.cit_ptr[i]:self.cit_ptr[i + 1]]
+
+    def authors(self, i):
+        return self.auth_idx[self.auth_ptr[i]:self.auth_ptr[i + 1]]
+
+    def gather_references(self, rows):
+        """References of all the given articles, concatenated."""
+        return gather(self.ref_ptr, self.ref_idx, rows)
+
+    def num_references(self, rows):
+        return self.ref_ptr[rows + 1] - self.ref_ptr[rows]
+
+    def num_citations(self, rows):
+        return self.cit_ptr[rows + 1] - self.cit_ptr[rows]
+
+    def num_authors(self, rows):
+        return self.auth_ptr[rows + 1] - self.auth_ptr[rows]
+
+    def dois(self):
+        """
+        Table of the id and DOI of the articles, as parse_graph saved it
+        with the graph, or None for a graph saved without one.
+        """
+        name = os.path.join(self.path, 'articles')
+        if not (os.path.exists(name + '.feather') or os.path.exists(name + '.csv')):
+            return None
+        return read_table(name, columns=['id', 'doi'])
+
+    def credit_matrix(self):
+        """
+        Sparse m x n matrix holding 1 / |authors| for every author of every
+        article, i.e. the credit each author takes for the article alone.
+        """
+        num_auths = np.diff(self.auth_ptr)
+        data = np.repeat(1.0 / np.maximum(num_auths, 1), num_auths)
+        return sparse.csr_matrix((data, self.auth_idx, self.auth_ptr), shape=(self.m, self.n))
+
+    @staticmethod
+    def dump(path, m, n, citing, cited, articles, authors, dois=None):
+        """
+        Saves a graph of m articles and n authors given as a list of
+        citing -> cited edges and a list of (article, author) pairs. Duplicate
+        edges are dropped, the order of authors within an article is kept.
+        dois, a table with the id and doi of the articles, is saved along,
+        so state computed for this graph can be matched by DOI to the
+        articles of a later one, whose ids may have shifted.
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        # the co-citation index and DOIs of the previous graph no longer apply
+        for file in glob.glob(os.path.join(path, 'cocite_*')) + glob.glob(os.path.join(path, 'articles.*')):
+            os.remove(file)
+
+        arrays = dict()
+        arrays['ref_ptr'], arrays['ref_idx'] = edges_to_csr(citing, cited, m)
+        arrays['cit_ptr'], arrays['cit_idx'] = edges_to_csr(cited, citing, m)
+        arrays['auth_ptr'], arrays['auth_idx'] = to_csr(np.asarray(articles),
+                                                        np.asarray(authors), m)
+        arrays['shape'] = np.array([m, n], dtype=np.int64)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+        if dois is not None:
+            write_table(dois[['id', 'doi']], os.path.join(path, 'articles'))
+
+
+class CocitationIndex(object):
+    """
+    Co-citation strengths S = R^T R of a CitGraph, R being its citing x
+    cited reference matrix, held in CSR arrays next to the graph: the papers
+    co-cited with paper i are idx[ptr[i]:ptr[i + 1]] and cnt holds how many
+    papers cite both. Weighted variants, which sum an importance of the
+    citing papers instead of counting them, share ptr and idx and are saved
+    as cocite_<name>.npy. The number of articles and references of the
+    graph, and a digest of the weights of every variant, are kept in
+    cocite_meta.db, to tell whether the index still fits.
+    """
+
+    def __init__(self, path=GRAPH, mmap_mode='r'):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.ptr = np.load(os.path.join(path, 'cocite_ptr.npy'), mmap_mode=mmap_mode)
+        self.idx = np.load(os.path.join(path, 'cocite_idx.npy'), mmap_mode=mmap_mode)
+        self.cnt = np.load(os.path.join(path, 'cocite_cnt.npy'), mmap_mode=mmap_mode)
+        self.weighted = dict()
+
+        meta = os.path.join(path, 'cocite_meta.db')
+        self.meta = dict()
+        if os.path.exists(meta):
+            with open(meta, 'rb') as fd:
+                self.meta = pickle.load(fd)
+
+    @staticmethod
+    def exists(path=GRAPH):
+        return os.path.exists(os.path.join(path, 'cocite_cnt.npy'))
+
+    @staticmethod
+    def digest(weights):
+        """Fingerprint of the weights of a variant."""
+        return hashlib.sha1(np.ascontiguousarray(weights, dtype=np.float64).tobytes()).hexdigest()
+
+    def matches(self, graph):
+        """Whether the index was built from graph, as far as its size tells."""
+        return self.meta.get('m') == len(graph) and self.meta.get('edges') == len(graph.ref_idx)
+
+    def has_weights(self, name, weights):
+        """Whether the variant of that name was built from these weights."""
+        digest = self.meta.get('weights', {}).get(name)
+        return digest is not None and digest == self.digest(weights) and self.data(name) is not None
+
+    def save_meta(self):
+        with open(os.path.join(self.path, 'cocite_meta.db'), 'wb') as fd:
+            pickle.dump(self.meta, fd)
+
+    def data(self, name=None):
+        """
+        Strengths aligned with idx: the counts if name is None, otherwise
+        the weighted variant of that name, or None if it was never built.
+        """
+        if name is None:
+            return self.cnt
+        if name not in self.weighted:
+            file = os.path.join(self.path, 'cocite_' + name + '.npy')
+            if not os.path.exists(file):
+                return None
+            self.weighted[name] = np.load(file, mmap_mode=self.mmap_mode)
+        return self.weighted[name]
+
+    def cocited(self, i, name=None):
+        """Papers co-cited with i and their strengths in the named variant."""
+        return self.idx[self.ptr[i]:self.ptr[i + 1]], self.data(name)[self.ptr[i]:self.ptr[i + 1]]
+
+    @staticmethod
+    def build(graph, chunk_size=4096):
+        """
+        Computes S chunk by chunk of chunk_size rows, as the product of the
+        rows of R^T (the citations of the papers in the chunk) with R, and
+        streams it to disk, so only one chunk of S is ever in memory.
+        """
+        m = len(graph)
+        meta = os.path.join(graph.path, 'cocite_meta.db')
+        if os.path.exists(meta):
+            os.remove(meta)
+        cited_by, refs = _citation_matrices(graph)
+        ptr = np.zeros(m + 1, dtype=np.int64)
+        idx = _ArrayWriter(os.path.join(graph.path, 'cocite_idx.npy'), np.int32)
+        cnt = _ArrayWriter(os.path.join(graph.path, 'cocite_cnt.npy'), np.int32)
+        for start in range(0, m, chunk_size):
+            end = min(start + chunk_size, m)
+            block = cited_by[start:end].dot(refs)
+            block.sort_indices()
+            ptr[start + 1:end + 1] = ptr[start] + block.indptr[1:]
+            idx.write(block.indices)
+            cnt.write(block.data)
+        idx.close()
+        cnt.close()
+        np.save(os.path.join(graph.path, 'cocite_ptr.npy'), ptr)
+
+        # written last, so an interrupted build leaves an index that does
+        # not match; variants of an earlier build are void
+        index = CocitationIndex(graph.path)
+        index.meta = {'m': m, 'edges': len(graph.ref_idx), 'weights': {}}
+        index.save_meta()
+
+    def add_weights(self, graph, name, weights, chunk_size=4096):
+        """
+        Saves the variant of S where each citing paper c adds weights[c]
+        rather than 1, aligned with the existing idx.
+        """
+        m = len(graph)
+        cited_by, refs = _citation_matrices(graph, weights)
+        out = _ArrayWriter(os.path.join(self.path, 'cocite_' + name + '.npy'), np.float64)
+        for start in range(0, m, chunk_size):
+            end = min(start + chunk_size, m)
+            block = cited_by[start:end].dot(refs).tocoo()
+
+            # zero weights may drop entries, so place the block's values at
+            # their positions in the count structure
+            lo, hi = self.ptr[start], self.ptr[end]
+            rows = np.repeat(np.arange(end - start), np.diff(self.ptr[start:end + 1]))
+            keys = rows * m + self.idx[lo:hi]
+            data = np.zeros(hi - lo)
+            data[np.searchsorted(keys, block.row.astype(np.int64) * m + block.col)] = block.data
+            out.write(data)
+        out.close()
+        self.weighted.pop(name, None)
+        self.meta.setdefault('weights', {})[name] = self.digest(weights)
+        self.save_meta()
+
+
+def _citation_matrices(graph, weights=None):
+    """
+    Sparse m x m matrices cited_by, with cited_by[i, c] = weights[c] (or 1)
+    if c cites i, and refs, with refs[c, k] = 1 if c cites k.
+    """
+    m = len(graph)
+    data = np.ones(len(graph.cit_idx)) if weights is None else np.asarray(weights)[graph.cit_idx]
+    cited_by = sparse.csr_matrix((data, graph.cit_idx, graph.cit_ptr), shape=(m, m))
+    refs = sparse.csr_matrix((np.ones(len(graph.ref_idx)), graph.ref_idx, graph.ref_ptr), shape=(m, m))
+    return cited_by, refs
+
+
+class _ArrayWriter(object):
+    """
+    Writes a 1-d .npy array whose length is only known at the end: chunks
+    are appended to a raw temporary file, then copied under a .npy header.
+    """
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.size = 0
+        self.file = open(path + '.tmp', 'wb')
+
+    def write(self, chunk):
+        chunk = np.ascontiguousarray(chunk, dtype=self.dtype)
+        self.file.write(chunk.tobytes())
+        self.size += len(chunk)
+
+    def close(self, chunk_size=1 << 24):
+        self.file.close()
+        out = np.lib.format.open_memmap(self.path, mode='w+', dtype=self.dtype, shape=(self.size,))
+        if self.size:
+            raw = np.memmap(self.path + '.tmp', dtype=self.dtype, mode='r', shape=(self.size,))
+            for start in range(0, self.size, chunk_size):
+                out[start:start + chunk_size] = raw[start:start + chunk_size]
+            del raw
+        out.flush()
+        del out
+        os.remove(self.path + '.tmp')
+
+
+class LRUCache(object):
+    """
+    Maps keys to numpy arrays, or tuples of them, within a budget of
+    max_bytes, evicting the least recently used entries first. Each entry
+    is charged the bytes of its arrays plus OVERHEAD for the bookkeeping.
+    """
+
+    OVERHEAD = 128
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, load):
+        """The value of key, computed by load(key) and kept on a miss."""
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+        self.misses += 1
+        value = load(key)
+        size = self.sizeof(value)
+        if size <= self.max_bytes:
+            self.entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+        return value
+
+    def sizeof(self, value):
+        arrays = value if isinstance(value, tuple) else (value,)
+        return self.OVERHEAD + sum(np.asarray(array).nbytes for array in arrays)
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self.entries), 'bytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+
+def to_csr(rows, cols, num_rows):
+    """
+    Groups cols by rows into CSR (ptr, idx) arrays. The sort is stable, so
+    cols of the same row keep their input order.
+    """
+    order = np.argsort(rows, kind='mergesort')
+    ptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=ptr[1:])
+    return ptr, cols[order].astype(np.int32)
+
+
+def gather(ptr, idx, rows):
+    """
+    Concatenation of idx[ptr[r]:ptr[r + 1]] over rows in one fancy-indexing
+    operation instead of a Python loop over the slices.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = ptr[rows]
+    lengths = ptr[rows + 1] - starts
+    # shift the running position within the output to the start of each row
+    shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return idx[shifts + np.arange(len(shifts))]
+
+
+def edges_to_csr(sources, targets, num_nodes):
+    """
+    CSR adjacency of a directed graph with duplicate edges removed and
+    the targets of every node sorted.
+    """
+    keys = np.sort(sources.astype(np.int64) * num_nodes + targets)
+    if len(keys):
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+    ptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // num_nodes, minlength=num_nodes), out=ptr[1:])
+    return ptr, (keys % num_nodes).astype(np.int32)
+
+
+def _parse_journal(job):
+    journal, parts = job
+    return CitNet().parse_journal(journal, parts)
 
 
 class CitNode(object):
@@ -221,22 +836,69 @@ class CitNode(object):
         self.citations = set()
 
 
-def citnet():
-    with open('citnodes.db', 'rb') as fd:
-        nodes = pickle.load(fd)
-
-        with open('citnet2.csv', 'a') as file:
-            file.write('Source,Target\n')
-            for citing in nodes.keys():
-                cited = nodes[citing].references
-
-                entries = [str(citing) + ',' + str(c) for c in cited]
-                lines = '\n'.join(entries) + '\n'
-                file.write(lines)
+def citnet(path='citnet2.csv', graph=GRAPH, header=True, chunk_size=1 << 22):
+    """
+    Exports the citing -> cited edges of the graph, sorted, to path,
+    overwriting it: as Source,Target CSV lines, without the header line
+    if header is False (as the PageRank binary reads them), or as raw
+    little endian int32 pairs if path ends with .bin. Edges are written in
+    chunks of chunk_size, formatted by whole arrays.
+    """
+    graph = CitGraph(graph) if isinstance(graph, str) else graph
+    binary = path.endswith('.bin')
+    num_edges = len(graph.ref_idx)
+    with open(path + '.tmp', 'wb') as file:
+        if header and not binary:
+            file.write(b'Source,Target\n')
+        for start in range(0, num_edges, chunk_size):
+            end = min(start + chunk_size, num_edges)
+            citing = np.searchsorted(graph.ref_ptr, np.arange(start, end), side='right') - 1
+            cited = graph.ref_idx[start:end]
+            if binary:
+                file.write(np.column_stack((citing, cited)).astype('<i4').tobytes())
+            else:
+                file.write(format_pairs(citing, cited))
+    os.replace(path + '.tmp', path)
+
+
+def format_pairs(first, second):
+    """
+    The bytes of the CSV lines 'first[k],second[k]' of two arrays of non
+    negative integers, formatted digit by digit over the whole arrays: the
+    lines are laid out right aligned in a byte matrix, whose leading zeros
+    are then masked out.
+    """
+    first = np.asarray(first, dtype=np.uint32)
+    second = np.asarray(second, dtype=np.uint32)
+    widths = [len(str(int(values.max()))) if len(values) else 1 for values in (first, second)]
+    lines = np.empty((len(first), widths[0] + widths[1] + 2), dtype=np.uint8)
+    keep = np.ones(lines.shape, dtype=bool)
+    _put_digits(first, lines[:, :widths[0]], keep[:, :widths[0]])
+    lines[:, widths[0]] = ord(',')
+    _put_digits(second, lines[:, widths[0] + 1:-1], keep[:, widths[0] + 1:-1])
+    lines[:, -1] = ord('\n')
+    return lines[keep].tobytes()
+
+
+def _put_digits(values, digits, keep):
+    """
+    Writes the ASCII digits of values right aligned into the columns of
+    digits, and clears keep on their leading zeros.
+    """
+    rest = values.copy()
+    for j in range(digits.shape[1] - 1, -1, -1):
+        rest, digit = np.divmod(rest, 10)
+        digits[:, j] = digit
+        if j < digits.shape[1] - 1:
+            keep[:, j] = values >= 10 ** (digits.shape[1] - 1 - j)
+    digits += ord('0')
 
 
 if __name__ == '__main__':
     citnet = CitNet()
     citnet.parse_aps()
+    # citnet.parse_aps(fmt='csv')
+    # export_csv('authors')
     # citnet.parse_nodes()
+    # citnet.parse_graph()
     # citnet()
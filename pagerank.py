@@ -0,0 +1,56 @@
+#!/usr/bin/env python3.5
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018 Chunheng Jiang (jiangchunheng@gmail.com)
+# Created at 3:05 PM Oct 17, 2018
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from datautil import GRAPH, TABLE_FORMAT, CitGraph, write_table
+
+PageRankResult = namedtuple('PageRankResult', ['scores', 'iterations', 'error', 'converged'])
+
+
+def pagerank(graph, damping=0.85, tol=1.0e-10, max_iter=300):
+    """
+    PageRank of the articles of a CitGraph by power iteration, the random
+    surfer following references with probability damping and jumping to a
+    uniformly random article otherwise. The score of dangling articles
+    (without references) is spread uniformly over all articles, as the
+    PageRank binary does. Iterations stop once the L1 change of the scores
+    drops below tol, or after max_iter of them.
+    """
+    m = len(graph)
+    cited_by = sparse.csr_matrix((np.ones(len(graph.cit_idx)), graph.cit_idx, graph.cit_ptr), shape=(m, m))
+    outdegrees = np.diff(graph.ref_ptr)
+    dangling = outdegrees == 0
+    inverse = np.zeros(m)
+    inverse[~dangling] = 1.0 / outdegrees[~dangling]
+
+    scores = np.full(m, 1.0 / m)
+    error, iteration = np.inf, 0
+    while iteration < max_iter and error >= tol:
+        previous = scores
+        scores = damping * cited_by.dot(previous * inverse)
+        scores += (damping * previous[dangling].sum() + 1.0 - damping) / m
+        error = np.abs(scores - previous).sum()
+        iteration += 1
+
+    converged = error < tol
+    print('PageRank {0} after {1} iterations, L1 change {2:.3e}'.format(
+        'converged' if converged else 'did not converge', iteration, error))
+    return PageRankResult(scores, iteration, error, converged)
+
+
+def dump(scores, name='pagerank', fmt=TABLE_FORMAT):
+    """Writes the scores in the i,pr layout PRImportanceBased reads."""
+    table = pd.DataFrame({'i': np.arange(len(scores)), 'pr': scores}, columns=['i', 'pr'])
+    write_table(table, name, fmt)
+
+
+if __name__ == '__main__':
+    result = pagerank(CitGraph(GRAPH))
+    dump(result.scores)
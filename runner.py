@@ -0,0 +1,156 @@
+#!/usr/bin/env python3.5
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018 Chunheng Jiang (jiangchunheng@gmail.com)
+# Created at 4:40 PM Oct 17, 2018
+
+"""
+Allocates the credit of every paper of the corpus on several cores, e.g.
+
+    python runner.py shen --processes 8 --output alloc_shen
+    python runner.py pr --scores pagerank --output alloc_pr
+
+Paper ids are split into shards and every shard is written to its own
+part file of the output directory. Part files already there are kept, so
+an interrupted run is resumed by running the same command again.
+"""
+
+import argparse
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from citcredit import PRImportanceBased, Shen, SimpleImportanceBased
+from datautil import GRAPH, CitGraph, CocitationIndex
+
+ALGORITHMS = {
+    'shen': Shen,
+    'simple': SimpleImportanceBased,
+    'pr': PRImportanceBased,
+}
+
+# allocator of the worker process, opened by its first shard
+_algo = None
+
+
+def make_algo(name, path=GRAPH, scores='pagerank'):
+    if name == 'pr':
+        return PRImportanceBased(path, scores)
+    return ALGORITHMS[name](path)
+
+
+def part_path(output, shard):
+    return os.path.join(output, 'part-{0:05d}.csv'.format(shard))
+
+
+def _run_shard(job):
+    global _algo
+    name, path, scores, shard, indices, output, batch_size = job
+    if _algo is None:
+        # the graph arrays are memory mapped, so the workers share the
+        # pages of the page cache instead of each holding a copy
+        _algo = make_algo(name, path, scores)
+
+    start = time.time()
+    table = _algo.allocate_many(indices, batch_size)
+
+    # write aside and rename, so a part file is either complete or missing
+    part = part_path(output, shard)
+    tmp = part + '.tmp'
+    table.to_csv(tmp, index=False)
+    os.replace(tmp, part)
+    return shard, len(indices), time.time() - start
+
+
+def graph_digest(graph, chunk_size=1 << 24):
+    """Fingerprint of the references and authors of graph."""
+    sha = hashlib.sha1()
+    for array in [graph.ref_ptr, graph.ref_idx, graph.auth_ptr, graph.auth_idx]:
+        for start in range(0, len(array), chunk_size):
+            sha.update(np.ascontiguousarray(array[start:start + chunk_size]).tobytes())
+    return sha.hexdigest()
+
+
+def shards(num_papers, shard_size):
+    """Splits the paper ids 0..num_papers-1 into consecutive shards."""
+    return [np.arange(start, min(start + shard_size, num_papers), dtype=np.int64)
+            for start in range(0, num_papers, shard_size)]
+
+
+def run(name, output, path=GRAPH, scores='pagerank', processes=None, shard_size=50000, batch_size=1024):
+    """
+    Allocates the credit of all papers of the graph at path with the
+    allocator called name, writing shard i to output/part-0000i.csv.
+    Shards whose part file exists are skipped, provided output was
+    written with the same allocator, graph, scores and shard size; the
+    graph is recognized by its numbers of articles, references and
+    authorships and a digest of its arrays, the scores of pr by a digest.
+    Returns the number of papers allocated by this run.
+    """
+    if not os.path.exists(output):
+        os.makedirs(output)
+
+    # part files of another allocator, graph, scores or sharding must not
+    # be taken for finished shards; a graph rebuilt in place, or scores
+    # recomputed under the same name, are told apart by their contents
+    graph = CitGraph(path)
+    marker = os.path.join(output, 'ALGO')
+    settings = '{0} graph={1} articles={2} references={3} authorships={4} graph_digest={5} scores={6} ' \
+               'shard_size={7}'.format(name, os.path.abspath(path), len(graph), len(graph.ref_idx),
+                                       len(graph.auth_idx), graph_digest(graph), scores, shard_size)
+    if name == 'pr':
+        settings += ' digest={0}'.format(CocitationIndex.digest(make_algo(name, path, scores).scores))
+    if os.path.exists(marker):
+        with open(marker) as file:
+            previous = file.read().strip()
+        if previous != settings:
+            raise ValueError('{0} holds the results of {1}, not {2}'.format(output, previous, settings))
+    else:
+        with open(marker, 'w+') as file:
+            file.write(settings + '\n')
+
+    num_papers = len(graph)
+    jobs = [(name, path, scores, shard, indices, output, batch_size)
+            for shard, indices in enumerate(shards(num_papers, shard_size))
+            if not os.path.exists(part_path(output, shard))]
+    skipped = (num_papers + shard_size - 1) // shard_size - len(jobs)
+    if skipped:
+        print('Resuming: {0} shards already done'.format(skipped))
+
+    start, done = time.time(), 0
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(_run_shard, job) for job in jobs]
+        for future in as_completed(futures):
+            shard, count, elapsed = future.result()
+            done += count
+            print('shard {0}: {1} papers in {2:.1f}s, {3:.0f} papers/sec overall'.format(
+                shard, count, elapsed, done / (time.time() - start)))
+
+    elapsed = time.time() - start
+    print('{0} papers in {1:.1f}s, {2:.0f} papers/sec'.format(done, elapsed, done / elapsed if elapsed else 0.0))
+    return done
+
+
+def read_parts(output):
+    """Concatenates the part files of output, in shard order."""
+    parts = sorted(name for name in os.listdir(output) if name.startswith('part-') and name.endswith('.csv'))
+    return pd.concat([pd.read_csv(os.path.join(output, part)) for part in parts], ignore_index=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Allocates the credit of every paper on several cores.')
+    parser.add_argument('algo', choices=sorted(ALGORITHMS.keys()))
+    parser.add_argument('--graph', default=GRAPH, help='directory of the citation graph arrays')
+    parser.add_argument('--scores', default='pagerank', help='PageRank scores table for the pr allocator')
+    parser.add_argument('--output', default=None, help='directory of the part files, alloc_<algo> by default')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes, all cores by default')
+    parser.add_argument('--shard-size', type=int, default=50000, help='papers per part file')
+    parser.add_argument('--batch-size', type=int, default=1024, help='papers per allocate_many batch')
+    args = parser.parse_args()
+
+    run(args.algo, args.output or 'alloc_' + args.algo, args.graph, args.scores,
+        args.processes, args.shard_size, args.batch_size)
@@ -7,6 +7,43 @@ page. It is not a recursive crawler.
 # ChangeLog
 # ---------
 #
+# 2.17  Keep-alive: connections are pooled and reused across requests
+#       to the same host, so a results page and its citation exports
+#       no longer cost a TCP and TLS handshake each. Responses are
+#       requested gzipped and decoded transparently, and the latency
+#       of every request is kept in ScholarQuerier.transport.timings
+#       (logged with -d). --no-keep-alive restores a connection per
+#       request.
+#
+# 2.16  Compact articles: ScholarArticle keeps its values in a slotted
+#       list and shares keys, labels and order with the other articles
+#       through a ScholarSchema. The attrs member is now a read-only
+#       copy in the old layout; index the article to change values.
+#       CSV output of many articles is converted a column at a time.
+#
+# 2.15  Faster parsing of results pages: with BeautifulSoup 4, only the
+#       result divs and the results count are built into the tree, by
+#       the lxml parser if installed. Set ScholarConf.FAST_PARSE to
+#       False to build the whole page as before.
+#
+# 2.14  Batch mode: --batch FILE runs every query listed in FILE, one
+#       per line in the form of the query arguments on the command
+#       line, through one querier, and writes all results to one
+#       output, by default stdout or else --output. Completed queries
+#       are recorded in a checkpoint file (--checkpoint, by default
+#       FILE.done), so an interrupted batch resumes where it stopped.
+#
+# 2.13  On-disk response cache: with --cache-dir DIR, responses to
+#       queries and citation exports are kept under DIR and reused for
+#       --cache-ttl seconds, within --cache-size megabytes, evicting the
+#       least recently used first. --no-cache bypasses the cache and
+#       --refresh-cache fetches anew and replaces cached responses.
+#
+# 2.12  Citation export data of the articles on a results page can be
+#       retrieved concurrently: --concurrency N fetches up to N of them
+#       at a time. --rate-limit SECONDS keeps requests to the same host
+#       at least that many seconds apart, whatever the concurrency.
+#
 # 2.11  The Scholar site seems to have become more picky about the
 #       number of results requested. The default of 20 in scholar.py
 #       could cause HTTP 503 responses. scholar.py now doesn't request
@@ -161,28 +198,44 @@ page. It is not a recursive crawler.
 # IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+from __future__ import print_function
+
+import gzip
+import hashlib
+import io
 import optparse
 import os
 import re
+import shlex
+import socket
 import sys
+import threading
+import time
 import warnings
 
+from multiprocessing.pool import ThreadPool
+
 try:
     # Try importing for Python 3
     # pylint: disable-msg=F0401
     # pylint: disable-msg=E0611
-    from urllib.request import HTTPCookieProcessor, Request, build_opener
-    from urllib.parse import quote, unquote
+    from urllib.request import HTTPCookieProcessor, HTTPHandler, HTTPSHandler, Request, build_opener
+    from urllib.error import URLError
+    from urllib.parse import quote, unquote, urlparse
+    from urllib.response import addinfourl
+    from http.client import HTTPConnection, HTTPException, HTTPSConnection
     from http.cookiejar import MozillaCookieJar
 except ImportError:
     # Fallback for Python 2
-    from urllib2 import Request, build_opener, HTTPCookieProcessor
-    from urllib import quote, unquote
+    from urllib2 import Request, build_opener, HTTPCookieProcessor, HTTPHandler, HTTPSHandler, URLError
+    from urllib import addinfourl, quote, unquote
+    from urlparse import urlparse
+    from httplib import HTTPConnection, HTTPException, HTTPSConnection
     from cookielib import MozillaCookieJar
 
 # Import BeautifulSoup -- try 4 first, fall back to older
 try:
-    from bs4 import BeautifulSoup
+    from bs4 import BeautifulSoup, SoupStrainer
 except ImportError:
     try:
         from BeautifulSoup import BeautifulSoup
@@ -218,10 +271,11 @@ class SoupKitchen(object):
     """Factory for creating BeautifulSoup instances."""
 
     @staticmethod
-    def make_soup(markup, parser=None):
+    def make_soup(markup, parser=None, parse_only=None):
         """Factory method returning a BeautifulSoup instance. The created
         instance will use a parser of the given name, if supported by
-        the underlying BeautifulSoup instance.
+        the underlying BeautifulSoup instance, and build only the tags
+        parse_only lets through, if given.
         """
         if 'bs4' in sys.modules:
             # We support parser specification. If the caller didn't
@@ -231,15 +285,58 @@ class SoupKitchen(object):
             # selects anyway.
             if parser is None:
                 warnings.filterwarnings('ignore', 'No parser was explicitly specified')
-            return BeautifulSoup(markup, parser)
+            return BeautifulSoup(markup, parser, parse_only=parse_only)
 
         return BeautifulSoup(markup)
 
+    @staticmethod
+    def fast_parser():
+        """lxml if it is installed, else the parser of the standard library."""
+        try:
+            import lxml  # pylint: disable-msg=W0612
+            return 'lxml'
+        except ImportError:
+            return 'html.parser'
+
+
+def _is_results_markup(name, attrs):
+    """
+    Whether a tag is one the results parsers read: a result div, of class
+    gs_r, or the div with id gs_ab_md holding the number of results.
+    """
+    if name != 'div' or not attrs:
+        return False
+    if attrs.get('id') == 'gs_ab_md':
+        return True
+    klass = attrs.get('class') or []
+    if not isinstance(klass, (list, tuple)):
+        klass = klass.split()
+    return 'gs_r' in klass
+
+
+if 'bs4' in sys.modules:
+    class ResultsStrainer(SoupStrainer):
+        """
+        Lets BeautifulSoup build only the result divs and the number of
+        results, with all their content. BeautifulSoup 4.13 and later ask
+        allow_tag_creation, earlier versions pass the tag name and
+        attributes to the name function.
+        """
+
+        def __init__(self):
+            SoupStrainer.__init__(self, _is_results_markup)
+
+        def allow_tag_creation(self, nsprefix, name, attrs):
+            return _is_results_markup(name, attrs)
+
+        def allow_string_creation(self, string):
+            return False
+
 
 class ScholarConf(object):
     """Helper class for global settings."""
 
-    VERSION = '2.10'
+    VERSION = '2.17'
     LOG_LEVEL = 1
     MAX_PAGE_RESULTS = 10  # Current default for per-page results
     SCHOLAR_SITE = 'http://scholar.google.com'
@@ -252,6 +349,32 @@ class ScholarConf(object):
     # cookie use across sessions.
     COOKIE_JAR_FILE = None
 
+    # If set, and with BeautifulSoup 4, results pages are parsed into a
+    # tree of the result divs and the number of results only.
+    FAST_PARSE = True
+
+    # Number of citation exports retrieved at the same time for the
+    # articles of a results page. 1 retrieves them one after the other.
+    MAX_CONCURRENT_REQUESTS = 1
+
+    # Minimum number of seconds between the starts of two requests to
+    # the same host. 0 disables rate limiting.
+    MIN_REQUEST_INTERVAL = 0
+
+    # If set, responses are cached in this directory (see ScholarCache)
+    # for CACHE_TTL seconds (None: forever), within CACHE_MAX_BYTES,
+    # gzipped if CACHE_COMPRESS. With CACHE_REFRESH, cached responses
+    # are not used but replaced by fresh ones.
+    CACHE_DIR = None
+    CACHE_TTL = 7 * 24 * 3600
+    CACHE_MAX_BYTES = 100 * 1024 * 1024
+    CACHE_COMPRESS = True
+    CACHE_REFRESH = False
+
+    # If set, connections are kept open and reused across requests to
+    # the same host (see ScholarConnectionPool).
+    KEEP_ALIVE = True
+
 
 class ScholarUtils(object):
     """A wrapper for various utensils that come in handy."""
@@ -278,77 +401,375 @@ class ScholarUtils(object):
         sys.stderr.flush()
 
 
+class ScholarRateLimiter(object):
+    """
+    Spaces out requests to the same host by at least a given interval,
+    across all threads sharing the limiter. Each caller reserves the next
+    free slot of the host and sleeps until it comes.
+    """
+
+    def __init__(self, interval=0):
+        self.interval = interval
+        self.next_slots = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        if self.interval <= 0:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slots.get(host, now))
+            self.next_slots[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ScholarConnectionPool(HTTPHandler, HTTPSHandler):
+    """
+    A urllib handler that keeps HTTP and HTTPS connections open and
+    reuses them for later requests to the same host, instead of a new
+    TCP (and TLS) connection per request. It asks for gzipped responses
+    and decodes them, and records the latency of every request in
+    timings, as (url, seconds, reused connection) triplets. Cookies,
+    redirects and errors are still handled by the other handlers of the
+    opener.
+    """
+
+    def __init__(self, max_idle=1):
+        HTTPHandler.__init__(self)
+        HTTPSHandler.__init__(self)
+        # idle connections per (scheme, host), at most max_idle each
+        self.max_idle = max_idle
+        self.idle = {}
+        self.timings = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def http_open(self, req):
+        return self._open(req, 'http')
+
+    def https_open(self, req):
+        return self._open(req, 'https')
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def log_stats(self):
+        count = len(self.timings)
+        total = sum(timing[1] for timing in self.timings)
+        ScholarUtils.log('info', 'http: %d requests over %d connections, %.3f s mean latency'
+                         % (count, self.connections, total / count if count else 0))
+
+    def _open(self, req, scheme):
+        host = req.host if not hasattr(req, 'get_host') else req.get_host()
+        if not host:
+            raise URLError('no host given')
+        tunnel = getattr(req, '_tunnel_host', None)
+        key = (scheme, host, tunnel)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((name, val) for name, val in req.headers.items() if name not in headers))
+        headers = dict((name.title(), val) for name, val in headers.items())
+        headers['Connection'] = 'keep-alive'
+        headers.setdefault('Accept-Encoding', 'gzip')
+        selector = req.selector if not hasattr(req, 'get_selector') else req.get_selector()
+
+        while True:
+            conn, reused = self._checkout(key, req.timeout)
+            start = time.time()
+            try:
+                conn.request(req.get_method(), selector, req.data, headers)
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except (HTTPException, socket.error) as err:
+                conn.close()
+                # The server may have closed an idle connection: try the
+                # next one, and fail only on a fresh connection.
+                if not reused:
+                    raise URLError(err)
+        elapsed = time.time() - start
+        with self.lock:
+            self.timings.append((req.get_full_url(), elapsed, reused))
+        ScholarUtils.log('debug', 'http: %s in %.3f s on a %s connection'
+                         % (req.get_full_url(), elapsed, 'reused' if reused else 'new'))
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._checkin(key, conn)
+
+        if (resp.getheader('Content-Encoding') or '').lower() == 'gzip':
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+            del resp.msg['Content-Encoding']
+            del resp.msg['Content-Length']
+
+        hdl = addinfourl(io.BytesIO(body), resp.msg, req.get_full_url(), resp.status)
+        hdl.msg = resp.reason
+        return hdl
+
+    def _checkout(self, key, timeout):
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop(), True
+            self.connections += 1
+
+        scheme, host, tunnel = key
+        if scheme == 'https':
+            context = getattr(self, '_context', None)
+            if context is not None:
+                conn = HTTPSConnection(host, timeout=timeout, context=context)
+            else:
+                conn = HTTPSConnection(host, timeout=timeout)
+        else:
+            conn = HTTPConnection(host, timeout=timeout)
+        if tunnel:
+            conn.set_tunnel(tunnel)
+        return conn, False
+
+    def _checkin(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+
+class ScholarCache(object):
+    """
+    An on-disk cache of HTTP responses, one file per normalized URL. A
+    file's modification time is the time it was stored, for expiry after
+    ttl seconds, and its access time is set on every hit, for evicting the
+    least recently used files once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, directory, ttl=None, max_bytes=None, compress=True):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.size = sum(os.path.getsize(path) for path in self._entries())
+        self._evict()
+
+    @staticmethod
+    def normalize(url):
+        """url with a lower case scheme and host and sorted arguments."""
+        parts = urlparse(url)
+        args = '&'.join(sorted(arg for arg in parts.query.split('&') if arg))
+        return '%s://%s%s?%s' % (parts.scheme.lower(), parts.netloc.lower(), parts.path, args)
+
+    def path(self, key):
+        name = hashlib.sha1(self.normalize(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + ('.gz' if self.compress else '.html'))
+
+    def get(self, key):
+        """The cached response for key, None if missing or expired."""
+        path = self.path(key)
+        with self.lock:
+            try:
+                stored = os.path.getmtime(path)
+                if self.ttl is not None and time.time() - stored > self.ttl:
+                    self._remove(path)
+                    data = None
+                else:
+                    data = self._read(path)
+                    os.utime(path, (time.time(), stored))
+            except (IOError, OSError):
+                data = None
+
+            if data is None:
+                self.misses += 1
+                ScholarUtils.log('debug', 'cache miss for %s' % unquote(key))
+            else:
+                self.hits += 1
+                ScholarUtils.log('debug', 'cache hit for %s' % unquote(key))
+            return data
+
+    def put(self, key, data):
+        """Caches data for key, then evicts down to max_bytes."""
+        path = self.path(key)
+        with self.lock:
+            if os.path.exists(path):
+                self._remove(path)
+            tmp = path + '.tmp'
+            if self.compress:
+                with gzip.open(tmp, 'wb') as hdl:
+                    hdl.write(data)
+            else:
+                with open(tmp, 'wb') as hdl:
+                    hdl.write(data)
+            _replace(tmp, path)
+            self.size += os.path.getsize(path)
+            self._evict()
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        ScholarUtils.log('info', 'cache: %d hits, %d misses (%.0f%% hits), %d bytes'
+                         % (self.hits, self.misses, 100.0 * self.hits / total if total else 0, self.size))
+
+    def _read(self, path):
+        if path.endswith('.gz'):
+            with gzip.open(path, 'rb') as hdl:
+                return hdl.read()
+        with open(path, 'rb') as hdl:
+            return hdl.read()
+
+    def _entries(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if name.endswith('.gz') or name.endswith('.html')]
+
+    def _remove(self, path):
+        self.size -= os.path.getsize(path)
+        os.remove(path)
+
+    def _evict(self):
+        if self.max_bytes is None or self.size <= self.max_bytes:
+            return
+        entries = sorted(self._entries(), key=os.path.getatime)
+        for path in entries:
+            if self.size <= self.max_bytes:
+                break
+            self._remove(path)
+            ScholarUtils.log('debug', 'cache evicted %s' % path)
+
+
+# Python 2 has no os.replace, where os.rename overwrites as well
+_replace = getattr(os, 'replace', os.rename)
+
+
+class ScholarSchema(object):
+    """
+    The attributes of a kind of ScholarArticle: their keys in output
+    order, user-suitable labels and default values. Articles of the
+    same kind share one schema and hold only their values.
+    """
+    __slots__ = ['keys', 'labels', 'defaults', 'index', 'txt_format', '_derived']
+
+    def __init__(self, items):
+        # The triplets for each keyword correspond to (1) the key, (2) a
+        # user-suitable label for the item, and (3) its default value:
+        self.keys = tuple(item[0] for item in items)
+        self.labels = tuple(item[1] for item in items)
+        self.defaults = tuple(item[2] for item in items)
+        self.index = dict((key, idx) for idx, key in enumerate(self.keys))
+        max_label_len = max([len(str(label)) for label in self.labels] + [0])
+        self.txt_format = '%%%ds %%s' % max_label_len
+        # Schemas with an attribute added or removed, so that articles
+        # changed the same way keep sharing one:
+        self._derived = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def items(self):
+        return list(zip(self.keys, self.labels, self.defaults))
+
+    def extended(self, key, label=None, default=None):
+        """The schema with attribute key appended."""
+        derived = self._derived.get(('+', key))
+        if derived is None:
+            derived = ScholarSchema(self.items() + [(key, label or key, default)])
+            self._derived[('+', key)] = derived
+        return derived
+
+    def without(self, key):
+        """The schema with attribute key removed."""
+        derived = self._derived.get(('-', key))
+        if derived is None:
+            derived = ScholarSchema([item for item in self.items() if item[0] != key])
+            self._derived[('-', key)] = derived
+        return derived
+
+
 class ScholarArticle(object):
     """
     A class representing articles listed on Google Scholar.  The class
     provides basic dictionary-like behavior.
     """
-
-    def __init__(self):
-        # The triplets for each keyword correspond to (1) the actual
-        # value, (2) a user-suitable label for the item, and (3) an
-        # ordering index:
-        self.attrs = {
-            'title': [None, 'Title', 0],
-            'url': [None, 'URL', 1],
-            'year': [None, 'Year', 2],
-            'num_citations': [0, 'Citations', 3],
-            'num_versions': [0, 'Versions', 4],
-            'cluster_id': [None, 'Cluster ID', 5],
-            'url_pdf': [None, 'PDF link', 6],
-            'url_citations': [None, 'Citations list', 7],
-            'url_versions': [None, 'Versions list', 8],
-            'url_citation': [None, 'Citation link', 9],
-            'excerpt': [None, 'Excerpt', 10],
-        }
+    # Harvests may hold hundreds of thousands of articles, so they keep
+    # their values in a list and share the keys, labels and order of
+    # their schema.
+    __slots__ = ['schema', 'values', 'citation_data']
+
+    SCHEMA = ScholarSchema([
+        ('title', 'Title', None),
+        ('url', 'URL', None),
+        ('year', 'Year', None),
+        ('num_citations', 'Citations', 0),
+        ('num_versions', 'Versions', 0),
+        ('cluster_id', 'Cluster ID', None),
+        ('url_pdf', 'PDF link', None),
+        ('url_citations', 'Citations list', None),
+        ('url_versions', 'Versions list', None),
+        ('url_citation', 'Citation link', None),
+        ('excerpt', 'Excerpt', None),
+    ])
+
+    def __init__(self, schema=None):
+        self.schema = schema or ScholarArticle.SCHEMA
+        self.values = list(self.schema.defaults)
 
         # The citation data in one of the standard export formats,
         # e.g. BibTeX.
         self.citation_data = None
 
+    @property
+    def attrs(self):
+        """
+        The [value, label, ordering index] triplet of each attribute,
+        keyed by attribute name. This is a copy: set values through
+        item assignment.
+        """
+        schema = self.schema
+        return dict((key, [self.values[idx], schema.labels[idx], idx])
+                    for idx, key in enumerate(schema.keys))
+
     def __getitem__(self, key):
-        if key in self.attrs:
-            return self.attrs[key][0]
+        idx = self.schema.index.get(key)
+        if idx is not None:
+            return self.values[idx]
         return None
 
     def __len__(self):
-        return len(self.attrs)
+        return len(self.values)
 
     def __setitem__(self, key, item):
-        if key in self.attrs:
-            self.attrs[key][0] = item
+        idx = self.schema.index.get(key)
+        if idx is not None:
+            self.values[idx] = item
         else:
-            self.attrs[key] = [item, key, len(self.attrs)]
+            self.schema = self.schema.extended(key)
+            self.values.append(item)
 
     def __delitem__(self, key):
-        if key in self.attrs:
-            del self.attrs[key]
+        idx = self.schema.index.get(key)
+        if idx is not None:
+            self.schema = self.schema.without(key)
+            del self.values[idx]
 
     def set_citation_data(self, citation_data):
         self.citation_data = citation_data
 
     def as_txt(self):
-        # Get items sorted in specified order:
-        items = sorted(list(self.attrs.values()), key=lambda item: item[2])
-        # Find largest label length:
-        max_label_len = max([len(str(item[1])) for item in items])
-        fmt = '%%%ds %%s' % max_label_len
-        res = []
-        for item in items:
-            if item[0] is not None:
-                res.append(fmt % (item[1], item[0]))
-        return '\n'.join(res)
+        fmt = self.schema.txt_format
+        return '\n'.join([fmt % (label, value)
+                          for label, value in zip(self.schema.labels, self.values)
+                          if value is not None])
 
     def as_csv(self, header=False, sep='|'):
-        # Get keys sorted in specified order:
-        keys = [pair[0] for pair in \
-                sorted([(key, val[2]) for key, val in list(self.attrs.items())],
-                       key=lambda pair: pair[1])]
-        res = []
-        if header:
-            res.append(sep.join(keys))
-        res.append(sep.join([unicode(self.attrs[key][0]) for key in keys]))
-        return '\n'.join(res)
+        return '\n'.join(ScholarArticle.csv_rows([self], header, sep))
 
     def as_citation(self):
         """
@@ -358,6 +779,30 @@ class ScholarArticle(object):
         """
         return self.citation_data or ''
 
+    @staticmethod
+    def csv_rows(articles, header=False, sep='|'):
+        """
+        The CSV lines of a list of articles, preceded by the keys of the
+        first if header is true. Runs of articles sharing a schema are
+        converted a column at a time.
+        """
+        rows = []
+        if header and articles:
+            rows.append(sep.join(articles[0].schema.keys))
+        start = 0
+        while start < len(articles):
+            schema, end = articles[start].schema, start + 1
+            while end < len(articles) and articles[end].schema is schema:
+                end += 1
+            if not schema.keys:
+                rows.extend([''] * (end - start))
+            else:
+                columns = zip(*[art.values for art in articles[start:end]])
+                columns = [[unicode(value) for value in column] for column in columns]
+                rows.extend(sep.join(row) for row in zip(*columns))
+            start = end
+        return rows
+
 
 class ScholarArticleParser(object):
     """
@@ -391,7 +836,10 @@ class ScholarArticleParser(object):
         content as needed, and notifies the parser instance of
         resulting instances via the handle_article callback.
         """
-        self.soup = SoupKitchen.make_soup(html)
+        if ScholarConf.FAST_PARSE and 'bs4' in sys.modules:
+            self.soup = SoupKitchen.make_soup(html, SoupKitchen.fast_parser(), ResultsStrainer())
+        else:
+            self.soup = SoupKitchen.make_soup(html)
 
         # This parses any global, non-itemized attributes from the page.
         self._parse_globals()
@@ -495,7 +943,7 @@ class ScholarArticleParser(object):
         has a class attribute.
         """
         res = tag.get('class') or []
-        if type(res) != list:
+        if not isinstance(res, list):
             # BeautifulSoup 3 can return e.g. 'gs_md_wp gs_ttss',
             # so split -- conveniently produces a list in any case
             res = res.split()
@@ -961,8 +1409,20 @@ class ScholarQuerier(object):
                 ScholarUtils.log('warn', 'could not load cookies file: %s' % msg)
                 self.cjar = MozillaCookieJar()  # Just to be safe
 
-        self.opener = build_opener(HTTPCookieProcessor(self.cjar))
+        # The cookie processor works on the requests and responses the
+        # connection pool sends and receives, as with urllib's handlers.
+        self.transport = None
+        if ScholarConf.KEEP_ALIVE:
+            self.transport = ScholarConnectionPool(max(1, ScholarConf.MAX_CONCURRENT_REQUESTS))
+            self.opener = build_opener(HTTPCookieProcessor(self.cjar), self.transport)
+        else:
+            self.opener = build_opener(HTTPCookieProcessor(self.cjar))
         self.settings = None  # Last settings object, if any
+        self.rate_limiter = ScholarRateLimiter(ScholarConf.MIN_REQUEST_INTERVAL)
+        self.cache = None
+        if ScholarConf.CACHE_DIR:
+            self.cache = ScholarCache(ScholarConf.CACHE_DIR, ScholarConf.CACHE_TTL,
+                                      ScholarConf.CACHE_MAX_BYTES, ScholarConf.CACHE_COMPRESS)
 
     def apply_settings(self, settings):
         """
@@ -979,7 +1439,8 @@ class ScholarQuerier(object):
         # the settings.
         html = self._get_http_response(url=self.GET_SETTINGS_URL,
                                        log_msg='dump of settings form HTML',
-                                       err_msg='requesting settings failed')
+                                       err_msg='requesting settings failed',
+                                       cached=False)
         if html is None:
             return False
 
@@ -1009,7 +1470,8 @@ class ScholarQuerier(object):
 
         html = self._get_http_response(url=self.SET_SETTINGS_URL % urlargs,
                                        log_msg='dump of settings result HTML',
-                                       err_msg='applying setttings failed')
+                                       err_msg='applying setttings failed',
+                                       cached=False)
         if html is None:
             return False
 
@@ -1028,9 +1490,10 @@ class ScholarQuerier(object):
                                        log_msg='dump of query response HTML',
                                        err_msg='results retrieval failed')
         if html is None:
-            return
+            return False
 
         self.parse(html)
+        return True
 
     def get_citation_data(self, article):
         """
@@ -1053,6 +1516,27 @@ class ScholarQuerier(object):
         article.set_citation_data(data)
         return True
 
+    def get_citations_data(self, articles):
+        """
+        Retrieves the citation export data of all given articles, up to
+        ScholarConf.MAX_CONCURRENT_REQUESTS of them at a time. Returns
+        the get_citation_data result for each article.
+        """
+        pending = [art for art in articles
+                   if art['url_citation'] is not None and art.citation_data is None]
+        workers = min(ScholarConf.MAX_CONCURRENT_REQUESTS, len(pending))
+        if workers <= 1:
+            return [self.get_citation_data(art) for art in articles]
+
+        ScholarUtils.log('info', 'retrieving %d citation exports, %d at a time'
+                         % (len(pending), workers))
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(self.get_citation_data, articles)
+        finally:
+            pool.close()
+            pool.join()
+
     def parse(self, html):
         """
         This method allows parsing of provided HTML content.
@@ -1060,8 +1544,14 @@ class ScholarQuerier(object):
         parser = self.Parser(self)
         parser.parse(html)
 
+        # With concurrency, the citation data of the articles is only
+        # retrieved once the whole page is parsed
+        if ScholarConf.MAX_CONCURRENT_REQUESTS > 1:
+            self.get_citations_data(self.articles)
+
     def add_article(self, art):
-        self.get_citation_data(art)
+        if ScholarConf.MAX_CONCURRENT_REQUESTS <= 1:
+            self.get_citation_data(art)
         self.articles.append(art)
 
     def clear_articles(self):
@@ -1084,15 +1574,34 @@ class ScholarQuerier(object):
             ScholarUtils.log('warn', 'could not save cookies file: %s' % msg)
             return False
 
-    def _get_http_response(self, url, log_msg=None, err_msg=None):
+    def _cache_key(self, url):
+        """
+        The cache key of url. Results pages depend on the citation format
+        set, so it is part of the key.
+        """
+        if self.settings is not None and self.settings.citform != 0:
+            return url + '&citform=%d' % self.settings.citform
+        return url
+
+    def _get_http_response(self, url, log_msg=None, err_msg=None, cached=True):
         """
         Helper method, sends HTTP request and returns response payload.
+        With a cache, and unless cached is False, the response is taken
+        from the cache if there and added to it otherwise.
         """
         if log_msg is None:
             log_msg = 'HTTP response data follow'
         if err_msg is None:
             err_msg = 'request failed'
+
+        cache = self.cache if cached else None
+        if cache is not None and not ScholarConf.CACHE_REFRESH:
+            html = cache.get(self._cache_key(url))
+            if html is not None:
+                return html
+
         try:
+            self.rate_limiter.wait(url)
             ScholarUtils.log('info', 'requesting %s' % unquote(url))
 
             req = Request(url=url, headers={'User-Agent': ScholarConf.USER_AGENT})
@@ -1107,21 +1616,23 @@ class ScholarQuerier(object):
             ScholarUtils.log('debug', 'data:\n' + html.decode('utf-8'))  # For Python 3
             ScholarUtils.log('debug', '<<<<' + '-' * 68)
 
+            if cache is not None:
+                cache.put(self._cache_key(url), html)
             return html
         except Exception as err:
             ScholarUtils.log('info', err_msg + ': %s' % err)
             return None
 
 
-def txt(querier, with_globals):
+def txt(querier, with_globals, out=None):
+    out = out or sys.stdout
     if with_globals:
         # If we have any articles, check their attribute labels to get
         # the maximum length -- makes for nicer alignment.
         max_label_len = 0
         if len(querier.articles) > 0:
-            items = sorted(list(querier.articles[0].attrs.values()),
-                           key=lambda item: item[2])
-            max_label_len = max([len(str(item[1])) for item in items])
+            labels = querier.articles[0].schema.labels
+            max_label_len = max([len(str(label)) for label in labels] + [0])
 
         # Get items sorted in specified order:
         items = sorted(list(querier.query.attrs.values()), key=lambda item: item[2])
@@ -1130,27 +1641,141 @@ def txt(querier, with_globals):
         fmt = '[G] %%%ds %%s' % max(0, max_label_len - 4)
         for item in items:
             if item[0] is not None:
-                print(fmt % (item[1], item[0]))
+                print(fmt % (item[1], item[0]), file=out)
         if len(items) > 0:
             print
 
     articles = querier.articles
     for art in articles:
-        print(encode(art.as_txt()) + '\n')
+        print(encode(art.as_txt()) + '\n', file=out)
 
 
-def csv(querier, header=False, sep='|'):
-    articles = querier.articles
-    for art in articles:
-        result = art.as_csv(header=header, sep=sep)
-        print(encode(result))
-        header = False
+def csv(querier, header=False, sep='|', out=None):
+    out = out or sys.stdout
+    for row in ScholarArticle.csv_rows(querier.articles, header, sep):
+        print(encode(row), file=out)
 
 
-def citation_export(querier):
+def citation_export(querier, out=None):
+    out = out or sys.stdout
     articles = querier.articles
     for art in articles:
-        print(art.as_citation() + '\n')
+        print(art.as_citation() + '\n', file=out)
+
+
+def output(querier, options, out=None, header=True):
+    """
+    Prints the articles of querier in the format chosen by options, the
+    CSV header only if header is true as well.
+    """
+    if options.csv:
+        csv(querier, out=out)
+    elif options.csv_header:
+        csv(querier, header=header, out=out)
+    elif options.citation is not None:
+        citation_export(querier, out=out)
+    else:
+        txt(querier, with_globals=options.txt_globals, out=out)
+
+
+def make_query(options):
+    """
+    The ClusterScholarQuery or SearchScholarQuery given by the query
+    arguments in options, None if they do not make sense together.
+    """
+    # Sanity-check the options: if they include a cluster ID query, it
+    # makes no sense to have search arguments:
+    if options.cluster_id is not None:
+        if options.author or options.allw or options.some or options.none \
+                or options.phrase or options.title_only or options.pub \
+                or options.after or options.before:
+            print('Cluster ID queries do not allow additional search arguments.')
+            return None
+
+    if options.cluster_id:
+        query = ClusterScholarQuery(cluster=options.cluster_id)
+    else:
+        query = SearchScholarQuery()
+        if options.author:
+            query.set_author(options.author)
+        if options.allw:
+            query.set_words(options.allw)
+        if options.some:
+            query.set_words_some(options.some)
+        if options.none:
+            query.set_words_none(options.none)
+        if options.phrase:
+            query.set_phrase(options.phrase)
+        if options.title_only:
+            query.set_scope(True)
+        if options.pub:
+            query.set_pub(options.pub)
+        if options.after or options.before:
+            query.set_timeframe(options.after, options.before)
+        if options.no_patents:
+            query.set_include_patents(False)
+        if options.no_citations:
+            query.set_include_citations(False)
+
+    if options.count is not None:
+        options.count = min(options.count, ScholarConf.MAX_PAGE_RESULTS)
+        query.set_num_page_results(options.count)
+    return query
+
+
+def batch(querier, parser, options):
+    """
+    Runs the queries of the job file options.batch, one per line given
+    by query arguments as on the command line, e.g.
+
+        -c 1 --phrase "10.1103/PhysRevLett.13.508"
+
+    Blank lines and lines starting with # are skipped. Every completed
+    query is appended to the checkpoint file, and skipped when the
+    batch runs again. Returns the number of queries that failed.
+    """
+    checkpoint = options.checkpoint or options.batch + '.done'
+    done = set()
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as hdl:
+            done = set(line.rstrip('\n') for line in hdl)
+
+    out = open(options.output, 'a') if options.output else sys.stdout
+    # a resumed batch continues the output, without a second header
+    header = out is sys.stdout or out.tell() == 0
+    failed = 0
+    try:
+        with open(options.batch) as jobs, open(checkpoint, 'a') as progress:
+            for job in jobs:
+                job = job.strip()
+                if not job or job.startswith('#'):
+                    continue
+                if job in done:
+                    ScholarUtils.log('info', 'skipping completed query: %s' % job)
+                    continue
+
+                try:
+                    job_options, _ = parser.parse_args(shlex.split(job))
+                except SystemExit:
+                    ScholarUtils.log('error', 'invalid query: %s' % job)
+                    failed += 1
+                    continue
+                query = make_query(job_options)
+                if query is None or not querier.send_query(query):
+                    ScholarUtils.log('error', 'query failed: %s' % job)
+                    failed += 1
+                    continue
+
+                output(querier, options, out, header)
+                out.flush()
+                header = False
+                progress.write(job + '\n')
+                progress.flush()
+                done.add(job)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return failed
 
 
 def main():
@@ -1216,8 +1841,32 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
     parser.add_option_group(group)
 
     group = optparse.OptionGroup(parser, 'Miscellaneous')
+    group.add_option('--batch', metavar='FILE', default=None,
+                     help='Run the queries in FILE, one per line given by query arguments as on the command line, e.g. -c 1 --phrase "quantum theory". Output options apply to all of them.')
+    group.add_option('--checkpoint', metavar='FILE', default=None,
+                     help='File recording the completed queries of a batch, which a rerun skips. Default is the batch file name plus ".done".')
+    group.add_option('--output', metavar='FILE', default=None,
+                     help='Append the results of a batch to FILE rather than printing them')
     group.add_option('--cookie-file', metavar='FILE', default=None,
                      help='File to use for cookie storage. If given, will read any existing cookies if found at startup, and save resulting cookies in the end.')
+    group.add_option('--concurrency', metavar='N', type='int', default=1,
+                     help='Number of citation exports to retrieve at the same time. Default is 1, one after the other.')
+    group.add_option('--rate-limit', metavar='SECONDS', type='float', default=0,
+                     help='Minimum number of seconds between two requests to the same host. Default is 0, no limit.')
+    group.add_option('--no-keep-alive', action='store_true', default=False,
+                     help='Open a new connection for every request instead of reusing them')
+    group.add_option('--cache-dir', metavar='DIR', default=None,
+                     help='Directory to cache responses in. If given, responses found there are reused instead of requested again.')
+    group.add_option('--cache-ttl', metavar='SECONDS', type='int', default=ScholarConf.CACHE_TTL,
+                     help='Number of seconds cached responses stay valid. Default is one week.')
+    group.add_option('--cache-size', metavar='MB', type='float', default=ScholarConf.CACHE_MAX_BYTES / 1024.0 / 1024.0,
+                     help='Maximum size of the cache in megabytes, least recently used responses are evicted first. Default is 100.')
+    group.add_option('--no-cache-compress', action='store_true', default=False,
+                     help='Store cached responses uncompressed')
+    group.add_option('--no-cache', action='store_true', default=False,
+                     help='Bypass the cache, neither reading nor writing it')
+    group.add_option('--refresh-cache', action='store_true', default=False,
+                     help='Request all responses anew and replace them in the cache')
     group.add_option('-d', '--debug', action='count', default=0,
                      help='Enable verbose logging to stderr. Repeated options increase detail of debug output.')
     group.add_option('-v', '--version', action='store_true', default=False,
@@ -1243,13 +1892,21 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
     if options.cookie_file:
         ScholarConf.COOKIE_JAR_FILE = options.cookie_file
 
-    # Sanity-check the options: if they include a cluster ID query, it
-    # makes no sense to have search arguments:
-    if options.cluster_id is not None:
-        if options.author or options.allw or options.some or options.none \
-                or options.phrase or options.title_only or options.pub \
-                or options.after or options.before:
-            print('Cluster ID queries do not allow additional search arguments.')
+    ScholarConf.MAX_CONCURRENT_REQUESTS = max(1, options.concurrency)
+    ScholarConf.MIN_REQUEST_INTERVAL = max(0, options.rate_limit)
+    ScholarConf.KEEP_ALIVE = not options.no_keep_alive
+
+    if options.cache_dir and not options.no_cache:
+        ScholarConf.CACHE_DIR = options.cache_dir
+        ScholarConf.CACHE_TTL = options.cache_ttl
+        ScholarConf.CACHE_MAX_BYTES = int(options.cache_size * 1024 * 1024)
+        ScholarConf.CACHE_COMPRESS = not options.no_cache_compress
+        ScholarConf.CACHE_REFRESH = options.refresh_cache
+
+    query = None
+    if not options.batch:
+        query = make_query(options)
+        if query is None:
             return 1
 
     querier = ScholarQuerier()
@@ -1269,50 +1926,25 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
 
     querier.apply_settings(settings)
 
-    if options.cluster_id:
-        query = ClusterScholarQuery(cluster=options.cluster_id)
-    else:
-        query = SearchScholarQuery()
-        if options.author:
-            query.set_author(options.author)
-        if options.allw:
-            query.set_words(options.allw)
-        if options.some:
-            query.set_words_some(options.some)
-        if options.none:
-            query.set_words_none(options.none)
-        if options.phrase:
-            query.set_phrase(options.phrase)
-        if options.title_only:
-            query.set_scope(True)
-        if options.pub:
-            query.set_pub(options.pub)
-        if options.after or options.before:
-            query.set_timeframe(options.after, options.before)
-        if options.no_patents:
-            query.set_include_patents(False)
-        if options.no_citations:
-            query.set_include_citations(False)
-
-    if options.count is not None:
-        options.count = min(options.count, ScholarConf.MAX_PAGE_RESULTS)
-        query.set_num_page_results(options.count)
-
-    querier.send_query(query)
-
-    if options.csv:
-        csv(querier)
-    elif options.csv_header:
-        csv(querier, header=True)
-    elif options.citation is not None:
-        citation_export(querier)
+    status = 0
+    if options.batch:
+        # one querier, and so one opener and cookie jar, for all queries
+        failed = batch(querier, parser, options)
+        if failed:
+            ScholarUtils.log('warn', '%d queries failed, rerun to retry them' % failed)
+            status = 1
     else:
-        txt(querier, with_globals=options.txt_globals)
-
+        querier.send_query(query)
+        output(querier, options)
     if options.cookie_file:
         querier.save_cookies()
+    if querier.cache is not None:
+        querier.cache.log_stats()
+    if querier.transport is not None:
+        querier.transport.log_stats()
+        querier.transport.close()
 
-    return 0
+    return status
 
 
 if __name__ == "__main__":
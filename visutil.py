@@ -4,7 +4,6 @@
 # Created at 12:58 AM Mar 26, 2018
 
 import numpy as np
-import pandas as pd
 import matplotlib
 
 matplotlib.use('TkAgg')
@@ -12,9 +11,11 @@ import matplotlib.pyplot as plt
 from sklearn.mixture import GMM
 import networkx as nx
 
+from datautil import read_table
+
 
 def authorship():
-    authship = pd.read_csv('authorship.csv')
+    authship = read_table('authorship')
     B = nx.Graph()
     B.add_nodes_from(authship['author'], bipartite=0)
     B.add_nodes_from(authship['article'], bipartite=1)